@@ -0,0 +1,101 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# Metrics / quan sát hệ thống
+SERVER_TIMING_ENABLED = env_bool("SERVER_TIMING_ENABLED", False)
+
+# Profiler MongoDB
+MONGO_SLOW_QUERY_MS = env_float("MONGO_SLOW_QUERY_MS", 100.0)
+# Chế độ test: request vượt ROUND_TRIP_BUDGETS sẽ ném lỗi thay vì chỉ ghi log
+MONGO_ROUND_TRIP_ASSERT = env_bool("MONGO_ROUND_TRIP_ASSERT", False)
+
+# Admission control cho các endpoint gọi AI
+AI_RATE_PER_MINUTE = env_float("AI_RATE_PER_MINUTE", 6.0)
+AI_BURST = env_int("AI_BURST", 10)
+AI_MAX_IN_FLIGHT = env_int("AI_MAX_IN_FLIGHT", 8)
+AI_MAX_QUEUE = env_int("AI_MAX_QUEUE", 32)
+AI_QUEUE_TIMEOUT_SECONDS = env_float("AI_QUEUE_TIMEOUT_SECONDS", 10.0)
+
+# Gọi Gemini: timeout, retry, hedge và circuit breaker
+AI_TIMEOUT_SECONDS = env_float("AI_TIMEOUT_SECONDS", 20.0)
+AI_RETRY_ATTEMPTS = env_int("AI_RETRY_ATTEMPTS", 2)
+AI_RETRY_BASE_DELAY_SECONDS = env_float("AI_RETRY_BASE_DELAY_SECONDS", 0.3)
+AI_RETRY_MAX_DELAY_SECONDS = env_float("AI_RETRY_MAX_DELAY_SECONDS", 2.0)
+# 0 = tắt hedge; nên đặt gần p95 của ai_call_duration_seconds vì mỗi hedge là một lời gọi tính phí
+AI_HEDGE_DELAY_SECONDS = env_float("AI_HEDGE_DELAY_SECONDS", 0.0)
+AI_BREAKER_FAILURE_THRESHOLD = env_int("AI_BREAKER_FAILURE_THRESHOLD", 5)
+AI_BREAKER_RESET_SECONDS = env_float("AI_BREAKER_RESET_SECONDS", 30.0)
+
+# Context cache của Gemini cho phần prompt chat cố định (cần đủ số token tối thiểu của model)
+AI_CONTEXT_CACHE_ENABLED = env_bool("AI_CONTEXT_CACHE_ENABLED", False)
+AI_CONTEXT_CACHE_TTL_SECONDS = env_int("AI_CONTEXT_CACHE_TTL_SECONDS", 3600)
+PERSONA_CACHE_TTL_SECONDS = env_int("PERSONA_CACHE_TTL_SECONDS", 3600)
+
+# Bộ phân loại cảm xúc cục bộ: chỉ gọi Gemini khi độ tin cậy thấp hơn ngưỡng hoặc cần lời khuyên
+LOCAL_CLASSIFIER_ENABLED = env_bool("LOCAL_CLASSIFIER_ENABLED", True)
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = env_float("LOCAL_CLASSIFIER_MIN_CONFIDENCE", 0.6)
+
+# Model giả lập chạy local để thử tải / thử circuit breaker mà không gọi Gemini thật
+AI_FAKE_MODEL = env_bool("AI_FAKE_MODEL", False)
+AI_FAKE_LATENCY_SECONDS = env_float("AI_FAKE_LATENCY_SECONDS", 0.2)
+AI_FAKE_FAILURE_RATE = env_float("AI_FAKE_FAILURE_RATE", 0.0)
+
+# Đồng bộ offline: số entry phân tích AI song song trong job nền
+SYNC_ANALYSIS_CONCURRENCY = env_int("SYNC_ANALYSIS_CONCURRENCY", 4)
+
+# Idempotency-Key cho các endpoint ghi dữ liệu có gọi AI
+IDEMPOTENCY_TTL_SECONDS = env_int("IDEMPOTENCY_TTL_SECONDS", 24 * 3600)
+IDEMPOTENCY_WAIT_SECONDS = env_float("IDEMPOTENCY_WAIT_SECONDS", 30.0)
+IDEMPOTENCY_CACHE_SIZE = env_int("IDEMPOTENCY_CACHE_SIZE", 10_000)
+
+# Cache hồ sơ user trong process; version trong document giúp các worker phát hiện bản cũ
+PROFILE_CACHE_SIZE = env_int("PROFILE_CACHE_SIZE", 10_000)
+PROFILE_CACHE_TTL_SECONDS = env_int("PROFILE_CACHE_TTL_SECONDS", 300)
+
+# Ngày địa phương tính sẵn cho nhật ký
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "UTC")
+BACKFILL_ENABLED = env_bool("BACKFILL_ENABLED", True)
+BACKFILL_BATCH_SIZE = env_int("BACKFILL_BATCH_SIZE", 500)
+BACKFILL_PAUSE_SECONDS = env_float("BACKFILL_PAUSE_SECONDS", 0.1)
+
+
+# Rollup định kỳ cho dashboard vận hành
+ROLLUP_ENABLED = env_bool("ROLLUP_ENABLED", True)
+ROLLUP_INTERVAL_SECONDS = env_float("ROLLUP_INTERVAL_SECONDS", 300.0)
+ROLLUP_BATCH_SIZE = env_int("ROLLUP_BATCH_SIZE", 1000)
+ROLLUP_MAX_BATCHES_PER_RUN = env_int("ROLLUP_MAX_BATCHES_PER_RUN", 50)
+# Chỉ gộp document cũ hơn mốc này để không bỏ sót các lượt ghi đang diễn ra
+ROLLUP_SETTLE_SECONDS = env_float("ROLLUP_SETTLE_SECONDS", 60.0)
+# Nhật ký đồng bộ còn chờ phân tích được gộp khi có kết quả; quá hạn này thì gộp như chưa phân tích
+ROLLUP_PENDING_MAX_WAIT_SECONDS = env_float("ROLLUP_PENDING_MAX_WAIT_SECONDS", 24 * 3600.0)
+ROLLUP_MAX_DEFERRED = env_int("ROLLUP_MAX_DEFERRED", 5000)
+# Token cho các endpoint /admin, để trống = tắt
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Lưu trữ lịch sử chat: tin nhắn cũ hơn CHAT_COMPACT_AFTER_DAYS được gộp vào chat_buckets,
+# TTL xóa hẳn tin nhắn gốc chưa được gộp sau CHAT_RAW_TTL_DAYS (0 = không dùng TTL)
+CHAT_COMPACTION_ENABLED = env_bool("CHAT_COMPACTION_ENABLED", True)
+CHAT_COMPACT_AFTER_DAYS = env_int("CHAT_COMPACT_AFTER_DAYS", 7)
+CHAT_COMPACTION_BATCH_SIZE = env_int("CHAT_COMPACTION_BATCH_SIZE", 1000)
+CHAT_COMPACTION_INTERVAL_SECONDS = env_float("CHAT_COMPACTION_INTERVAL_SECONDS", 3600.0)
+CHAT_RAW_TTL_DAYS = env_int("CHAT_RAW_TTL_DAYS", 30)
@@ -0,0 +1,10 @@
+# Thang cảm xúc 5 mức người dùng chọn cho nhật ký, kèm điểm dùng cho thống kê và xu hướng.
+# Không import gì trong app: model (app.models.journal) và service đều dùng được mà không kéo theo database
+EMOTION_SCORES = {
+    "Rất tốt": 5, 
+    "Tốt": 4, 
+    "Bình thường": 3, 
+    "Tệ": 2, 
+    "Rất tệ": 1
+}
+DEFAULT_SCORE = 3
@@ -0,0 +1,329 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.family_name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.family_name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    @property
+    def family_name(self) -> str:
+        # Tên dùng cho dòng HELP / TYPE, phải trùng tên series
+        return self.name
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: cần đúng các label {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _label_pairs(self, key: Tuple[str, ...], *extra: Tuple[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labelnames, key)) + extra
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    @property
+    def family_name(self) -> str:
+        return self.name + "_total"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.family_name, self._label_pairs(key), value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._label_pairs(key), value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", self._label_pairs(key, ("le", _format_value(bound))), cumulative
+            yield self.name + "_sum", self._label_pairs(key), total
+            yield self.name + "_count", self._label_pairs(key), count
+
+
+# ==========================================
+# METRICS CỦA ỨNG DỤNG
+# ==========================================
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request theo route.",
+    ("method", "route", "status"),
+)
+DB_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "Thời gian mỗi lệnh MongoDB.",
+    ("command", "collection"),
+)
+DB_COMMAND_FAILURES = Counter(
+    "mongo_command_failures", "Số lệnh MongoDB bị lỗi.",
+    ("command", "collection"),
+)
+DB_ROUND_TRIPS = Histogram(
+    "mongo_round_trips_per_request", "Số lần gọi MongoDB trong một request.",
+    ("route",), buckets=(1, 2, 3, 4, 5, 8, 13, 21, 34),
+)
+DB_DOCUMENTS_RETURNED = Counter(
+    "mongo_documents_returned", "Số document MongoDB trả về theo route.",
+    ("route", "command", "collection"),
+)
+DB_SLOW_QUERIES = Counter(
+    "mongo_slow_queries", "Số lệnh MongoDB vượt ngưỡng MONGO_SLOW_QUERY_MS.",
+    ("route", "command", "collection"),
+)
+AI_CALL_DURATION = Histogram(
+    "ai_call_duration_seconds", "Thời gian gọi Gemini theo hàm trong ai_service.",
+    ("function",),
+)
+AI_IMAGE_FETCH_DURATION = Histogram(
+    "ai_image_fetch_duration_seconds", "Thời gian tải ảnh gửi kèm cho AI.",
+)
+AI_FALLBACKS = Counter(
+    "ai_fallbacks", "Số lần trả về kết quả mặc định thay cho câu trả lời của AI.",
+    ("function", "reason"),
+)
+
+AI_ADMISSION_REJECTED = Counter(
+    "ai_admission_rejected", "Số request AI bị từ chối hoặc hạ cấp bởi admission control.",
+    ("reason",),
+)
+AI_ADMISSION_QUEUED = Counter(
+    "ai_admission_queued", "Số request AI phải xếp hàng chờ slot.",
+)
+AI_ADMISSION_WAIT = Histogram(
+    "ai_admission_wait_seconds", "Thời gian chờ slot gọi AI.",
+)
+AI_IN_FLIGHT = Gauge(
+    "ai_in_flight", "Số lời gọi AI đang chạy.",
+)
+AI_QUEUE_DEPTH = Gauge(
+    "ai_queue_depth", "Số request AI đang xếp hàng.",
+)
+
+CIRCUIT_STATE = Gauge(
+    "ai_circuit_state", "Trạng thái circuit breaker (0=closed, 1=half_open, 2=open).",
+    ("name",),
+)
+CIRCUIT_SHORT_CIRCUITS = Counter(
+    "ai_circuit_short_circuits", "Số lời gọi bị chặn ngay vì circuit đang mở.",
+    ("name",),
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "ai_circuit_transitions", "Số lần circuit breaker đổi trạng thái.",
+    ("name", "state"),
+)
+AI_RETRIES = Counter(
+    "ai_retries", "Số lần gọi lại AI sau lỗi tạm thời.",
+    ("function",),
+)
+AI_HEDGES = Counter(
+    "ai_hedged_requests", "Số request dự phòng (hedge) được gửi và bên thắng.",
+    ("function", "winner"),
+)
+IDEMPOTENT_REPLAYS = Counter(
+    "idempotent_replays", "Số request lặp lại Idempotency-Key được trả kết quả đã lưu.",
+    ("scope", "source"),
+)
+AI_PROMPT_TOKENS = Histogram(
+    "ai_prompt_tokens", "Số token đầu vào mỗi lời gọi Gemini (usage_metadata.prompt_token_count).",
+    ("function",), buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+AI_CACHED_PROMPT_TOKENS = Counter(
+    "ai_cached_prompt_tokens", "Số token đầu vào được phục vụ từ cache của Gemini.",
+    ("function",),
+)
+AI_PARSE_FAILURES = Counter(
+    "ai_parse_failures", "Số phản hồi AI không khớp schema, theo lượt (initial | repair).",
+    ("function", "stage"),
+)
+LOCAL_ANALYSES = Counter(
+    "local_analyses", "Số nhật ký qua bộ phân loại cục bộ, theo kết quả (local | escalated).",
+    ("outcome",),
+)
+LOCAL_CLASSIFIER_DURATION = Histogram(
+    "local_classifier_duration_seconds", "Thời gian phân loại cảm xúc cục bộ.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025),
+)
+ROLLUP_DOCUMENTS = Counter(
+    "rollup_documents", "Số document đã được gộp vào daily_rollups.",
+    ("source",),
+)
+ROLLUP_LAG_SECONDS = Gauge(
+    "rollup_lag_seconds", "Độ trễ của watermark rollup so với thời điểm hiện tại.",
+    ("source",),
+)
+CHAT_MESSAGES_COMPACTED = Counter(
+    "chat_messages_compacted", "Số tin nhắn chat đã được gộp vào chat_buckets.",
+)
+
+# ==========================================
+# PER-REQUEST TIMING
+# ==========================================
+
+class RequestContext:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.route = path
+        self.timings: Dict[str, float] = {}
+        self.db_commands: List[object] = []
+
+    def add_timing(self, phase: str, seconds: float):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+
+_current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    return _current_request.get()
+
+
+def bind_request(ctx: RequestContext) -> Token:
+    return _current_request.set(ctx)
+
+
+def unbind_request(token: Token):
+    _current_request.reset(token)
+
+
+def record_phase(phase: str, seconds: float):
+    ctx = _current_request.get()
+    if ctx is not None:
+        ctx.add_timing(phase, seconds)
+
+
+@contextmanager
+def track(histogram: Histogram, phase: Optional[str] = None, **labels):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        if phase:
+            record_phase(phase, elapsed)
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,43 @@
+from time import perf_counter
+from typing import AsyncIterator
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from app.core.config import SERVER_TIMING_ENABLED
+from app.core.metrics import (
+    HTTP_REQUEST_DURATION, RequestContext, bind_request, unbind_request, server_timing_header,
+)
+from app.db.monitoring import summarize_request
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        ctx = RequestContext(request.method, request.url.path)
+        token = bind_request(ctx)
+        start = perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            elapsed = perf_counter() - start
+            route = request.scope.get("route")
+            ctx.route = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(elapsed, method=request.method, route=ctx.route, status=status_code)
+            unbind_request(token)
+
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = server_timing_header(ctx.timings, elapsed)
+        response.body_iterator = _summarize_after_body(response.body_iterator, ctx)
+        return response
+
+
+async def _summarize_after_body(body: AsyncIterator[bytes], ctx: RequestContext) -> AsyncIterator[bytes]:
+    # StreamingResponse (vd: /journal/export) còn truy vấn Mongo trong lúc gửi body:
+    # chỉ tổng kết round trip của request sau khi body đã gửi xong
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        summarize_request(ctx)
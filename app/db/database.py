@@ -1,16 +1,24 @@
 import os
 from pymongo import MongoClient
 from pymongo.database import Database
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import ConnectionFailure, OperationFailure
 from dotenv import load_dotenv
+from app.core.config import (
+    IDEMPOTENCY_TTL_SECONDS, CHAT_RAW_TTL_DAYS, CHAT_COMPACT_AFTER_DAYS, CHAT_COMPACTION_ENABLED,
+)
+from app.db.monitoring import CommandMetricsListener
 
 load_dotenv()
 
+# Marker user hoạt động theo ngày chỉ cần giữ trong lúc ngày đó còn được rollup
+ROLLUP_MARKER_TTL_SECONDS = 7 * 24 * 3600
+INDEX_OPTIONS_CONFLICT = 85
+
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
 
 try:
-    client = MongoClient(MONGO_URI)
+    client = MongoClient(MONGO_URI, event_listeners=[CommandMetricsListener()])
     client.admin.command('ping')
     print("✅ Kết nối MongoDB thành công!")
     db = client[DB_NAME]
@@ -32,3 +40,88 @@ def get_journal_collection():
 
 def get_user_collection():
     return get_database()["users"]
+
+def get_chat_collection():
+    return get_database()["chat_messages"]
+
+def get_chat_bucket_collection():
+    return get_database()["chat_buckets"]
+
+def get_idempotency_collection():
+    return get_database()["idempotency_keys"]
+
+def get_migration_collection():
+    return get_database()["migrations"]
+
+def get_job_collection():
+    return get_database()["jobs"]
+
+def get_rollup_collection():
+    return get_database()["daily_rollups"]
+
+def get_rollup_marker_collection():
+    return get_database()["rollup_active_users"]
+
+def is_connected() -> bool:
+    return db is not None
+
+def ensure_ttl_index(collection, field: str, expire_after_seconds: int):
+    # Đổi TTL trong cấu hình: cập nhật index đang có thay vì báo lỗi conflict
+    try:
+        collection.create_index(field, expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        get_database().command(
+            "collMod", collection.name,
+            index={"keyPattern": {field: 1}, "expireAfterSeconds": expire_after_seconds},
+        )
+
+def ensure_chat_timestamp_index() -> bool:
+    # Index thường cho truy vấn gộp tin nhắn cũ; False nếu đã có index TTL trên timestamp
+    try:
+        get_chat_collection().create_index("timestamp")
+        return True
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        return False
+
+def ensure_chat_ttl_index():
+    ensure_ttl_index(get_chat_collection(), "timestamp", CHAT_RAW_TTL_DAYS * 24 * 3600)
+
+def ensure_indexes():
+    if db is None:
+        print("Bỏ qua tạo index: chưa kết nối được MongoDB")
+        return
+    # Export / đọc tuần tự theo user, sắp theo _id
+    get_journal_collection().create_index([("user_id", 1), ("_id", 1)])
+    get_chat_collection().create_index([("user_id", 1), ("_id", 1)])
+    # Lịch sử chat: tin nhắn gốc mới nhất theo user, tin nhắn cũ theo bucket ngày
+    get_chat_collection().create_index([("user_id", 1), ("timestamp", -1)])
+    get_chat_bucket_collection().create_index([("user_id", 1), ("day", -1)])
+    if CHAT_RAW_TTL_DAYS > 0:
+        if CHAT_RAW_TTL_DAYS <= CHAT_COMPACT_AFTER_DAYS:
+            print("Cảnh báo: CHAT_RAW_TTL_DAYS nên lớn hơn CHAT_COMPACT_AFTER_DAYS, nếu không tin nhắn sẽ bị xóa trước khi được gộp")
+        if CHAT_COMPACTION_ENABLED:
+            # TTL do run_chat_compactor tạo sau khi gộp hết tin nhắn cũ: tạo ngay lúc deploy lần đầu
+            # thì tin nhắn đã quá hạn bị xóa trước khi kịp vào chat_buckets
+            ensure_chat_timestamp_index()
+        else:
+            ensure_chat_ttl_index()
+    elif not ensure_chat_timestamp_index():
+        print("Cảnh báo: đã tắt CHAT_RAW_TTL_DAYS nhưng index TTL cũ trên chat_messages.timestamp vẫn còn, cần drop thủ công")
+    # Đồng bộ offline: mỗi client_id chỉ được ghi một lần cho mỗi user
+    get_journal_collection().create_index(
+        [("user_id", 1), ("client_id", 1)],
+        unique=True,
+        partialFilterExpression={"client_id": {"$exists": True}},
+    )
+    # Thống kê theo ngày địa phương tính sẵn
+    get_journal_collection().create_index([("user_id", 1), ("local_date", 1)])
+    get_journal_collection().create_index(
+        [("user_id", 1), ("analysis_status", 1)],
+        partialFilterExpression={"analysis_status": "pending"},
+    )
+    get_idempotency_collection().create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    get_rollup_marker_collection().create_index("created_at", expireAfterSeconds=ROLLUP_MARKER_TTL_SECONDS)
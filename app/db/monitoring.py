@@ -0,0 +1,153 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import monitoring
+
+from app.core.config import MONGO_SLOW_QUERY_MS, MONGO_ROUND_TRIP_ASSERT
+from app.core.metrics import (
+    DB_COMMAND_DURATION, DB_COMMAND_FAILURES, DB_ROUND_TRIPS, DB_DOCUMENTS_RETURNED, DB_SLOW_QUERIES,
+    RequestContext, bind_request, current_request, unbind_request,
+)
+
+# Số round trip tối đa cho mỗi endpoint (tính cả lần upsert user trong get_current_user_id).
+# Chỉ kiểm tra khi bật MONGO_ROUND_TRIP_ASSERT (chế độ test).
+# Endpoint có Idempotency-Key tốn thêm 2 lần (giữ key + lưu response).
+# GET /journal/export không có giới hạn: số getMore tăng theo lượng dữ liệu của user.
+ROUND_TRIP_BUDGETS: Dict[str, int] = {
+    "POST /journal/new": 4,
+    "POST /journal/sync": 3,
+    "GET /journal/history": 3,
+    "GET /journal/first-date": 2,
+    "GET /journal/{entry_id}": 2,
+    "PUT /journal/{entry_id}": 2,
+    "DELETE /journal/{entry_id}": 2,
+    "POST /journal/analyze": 1,
+    # upsert user + tin nhắn gốc + chat_buckets (khi chưa đủ CONTEXT_MESSAGES tin gốc) + insert_many
+    "POST /chat/send": 6,
+    "GET /chat/history": 3,
+    "DELETE /chat/history": 4,
+    "GET /user/profile": 2,
+    "PUT /user/profile": 2,
+    "GET /stats/weekly": 5,
+    "GET /stats/monthly": 5,
+    "GET /relax/sounds": 2,
+}
+
+SLOW_QUERY_LOG_SIZE = 200
+
+
+class CommandRecord(NamedTuple):
+    command: str
+    collection: str
+    seconds: float
+    documents: int
+    failed: bool
+
+
+class RoundTripBudgetExceeded(AssertionError):
+    pass
+
+
+_slow_queries: Deque[dict] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def _collection_name(event: monitoring.CommandStartedEvent) -> str:
+    target = event.command.get(event.command_name)
+    if isinstance(target, str):
+        return target
+    # getMore mang cursor id ở khóa chính, tên collection nằm ở "collection"
+    return str(event.command.get("collection", ""))
+
+
+def _documents_returned(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if "value" in reply:
+        return 1 if reply["value"] else 0
+    return int(reply.get("n", 0))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Tuple[str, Optional[RequestContext]]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (_collection_name(event), current_request())
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, _documents_returned(event.reply), failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._finish(event, 0, failed=True)
+        DB_COMMAND_FAILURES.inc(command=event.command_name, collection=collection)
+
+    def _finish(self, event, documents: int, failed: bool) -> str:
+        with self._lock:
+            collection, ctx = self._pending.pop((event.connection_id, event.request_id), ("", None))
+        seconds = event.duration_micros / 1_000_000
+        DB_COMMAND_DURATION.observe(seconds, command=event.command_name, collection=collection)
+        if ctx is not None:
+            ctx.add_timing("db", seconds)
+            ctx.db_commands.append(CommandRecord(event.command_name, collection, seconds, documents, failed))
+        return collection
+
+
+def summarize_request(ctx: RequestContext):
+    # Gọi khi đã gửi xong body, lúc này ctx.route đã là route template (vd: /journal/{entry_id})
+    commands: List[CommandRecord] = ctx.db_commands
+    if not commands:
+        return
+    DB_ROUND_TRIPS.observe(len(commands), route=ctx.route)
+
+    for record in commands:
+        if record.documents:
+            DB_DOCUMENTS_RETURNED.inc(record.documents, route=ctx.route, command=record.command, collection=record.collection)
+        if record.seconds * 1000 >= MONGO_SLOW_QUERY_MS:
+            DB_SLOW_QUERIES.inc(route=ctx.route, command=record.command, collection=record.collection)
+            entry = {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "route": f"{ctx.method} {ctx.route}",
+                "command": record.command,
+                "collection": record.collection,
+                "duration_ms": round(record.seconds * 1000, 1),
+                "documents": record.documents,
+                "round_trips_in_request": len(commands),
+            }
+            _slow_queries.append(entry)
+            print(f"🐢 Slow query: {entry}")
+
+    if MONGO_ROUND_TRIP_ASSERT:
+        check_round_trip_budget(ctx)
+
+
+def check_round_trip_budget(ctx: RequestContext):
+    endpoint = f"{ctx.method} {ctx.route}"
+    budget = ROUND_TRIP_BUDGETS.get(endpoint)
+    if budget is not None and len(ctx.db_commands) > budget:
+        detail = ", ".join(f"{r.command}({r.collection})" for r in ctx.db_commands)
+        raise RoundTripBudgetExceeded(
+            f"{endpoint}: {len(ctx.db_commands)} round trip, vượt giới hạn {budget} [{detail}]"
+        )
+
+
+def recent_slow_queries() -> List[dict]:
+    return list(_slow_queries)
+
+
+@contextmanager
+def assert_max_round_trips(limit: int):
+    # Dùng trong test cho đoạn code chạy ngoài request HTTP (job nền, script)
+    ctx = RequestContext("TEST", "assert_max_round_trips")
+    token = bind_request(ctx)
+    try:
+        yield ctx
+    finally:
+        unbind_request(token)
+    if len(ctx.db_commands) > limit:
+        raise RoundTripBudgetExceeded(f"{len(ctx.db_commands)} round trip, vượt giới hạn {limit}")
@@ -1,16 +1,47 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from app.db.database import ensure_indexes, is_connected
+from app.core.config import BACKFILL_ENABLED, ROLLUP_ENABLED, CHAT_COMPACTION_ENABLED
+from app.services.backfill_service import run_backfill
+from app.services.rollup_service import run_rollup_scheduler
+from app.services.chat_history_service import run_chat_compactor
+from app.core.middleware import MetricsMiddleware
+from app.services.admission import AdmissionRejected, admission_rejected_handler
 from app.routers import journal_router
 from app.routers import chat_router
 from app.routers import user_router
 from app.routers import stat_router
 from app.routers import relax_router
+from app.routers import metrics_router
+from app.routers import admin_router
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_indexes()
+    background_jobs = []
+    if BACKFILL_ENABLED and is_connected():
+        background_jobs.append(asyncio.create_task(run_backfill()))
+    if ROLLUP_ENABLED and is_connected():
+        background_jobs.append(asyncio.create_task(run_rollup_scheduler()))
+    if CHAT_COMPACTION_ENABLED and is_connected():
+        background_jobs.append(asyncio.create_task(run_chat_compactor()))
+    yield
+    for job in background_jobs:
+        job.cancel()
 
 app = FastAPI(
-    title="MyMoodApp Backend", description="Backend cho ứng dụng ghi nhận cảm xúc."
+    title="MyMoodApp Backend", description="Backend cho ứng dụng ghi nhận cảm xúc.",
+    lifespan=lifespan,
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_exception_handler(AdmissionRejected, admission_rejected_handler)
+
 app.include_router(user_router.router)
 app.include_router(journal_router.router)
 app.include_router(chat_router.router)
 app.include_router(stat_router.router)
 app.include_router(relax_router.router)
+app.include_router(metrics_router.router)
+app.include_router(admin_router.router)
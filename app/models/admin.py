@@ -0,0 +1,32 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from datetime import date, datetime
+
+from app.models.stat import MoodCountStat
+
+class DailyRollup(BaseModel):
+    date: date
+    active_users: int = 0
+    journal_entries: int = 0
+    avg_mood_score: Optional[float] = None
+    mood_distribution: List[MoodCountStat] = []
+
+    # ai | local | fallback | none; tỉ lệ fallback tính trên số nhật ký đã phân tích
+    analysis_sources: Dict[str, int] = {}
+    analysis_fallback_rate: Optional[float] = None
+
+    chat_user_messages: int = 0
+    chat_bot_replies: int = 0
+    chat_fallbacks: int = 0
+    chat_fallback_rate: Optional[float] = None
+
+class RollupStatus(BaseModel):
+    last_run_at: Optional[datetime] = None
+    running: bool = False
+    # Nhật ký đồng bộ đang chờ phân tích xong mới được gộp
+    deferred_entries: int = 0
+    watermarks: Dict[str, Optional[datetime]] = {}
+
+class RollupRunResult(BaseModel):
+    started: bool
+    processed: Dict[str, int] = {}
@@ -17,6 +17,11 @@ class ChatMessage(BaseModel):
         json_encoders={ObjectId: str}
     )
 
+class ChatHistoryPage(BaseModel):
+    # Xếp từ mới đến cũ; next_cursor = None khi đã hết lịch sử
+    messages: List[ChatMessage]
+    next_cursor: Optional[str] = None
+
 class UserInfoSchema(BaseModel):
     name: str = "Bạn"
     gender: str = "bạn"
@@ -25,5 +30,6 @@ class UserInfoSchema(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: list = []
-    user_info: UserInfoSchema
+    # Không cần gửi nữa: server lấy từ hồ sơ user; chỉ dùng cho trường hồ sơ còn trống
+    user_info: Optional[UserInfoSchema] = None
     
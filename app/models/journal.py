@@ -1,10 +1,14 @@
 from typing import Optional, Any, Dict, List
-from pydantic import BaseModel, Field, GetCoreSchemaHandler, GetJsonSchemaHandler, ConfigDict
+from pydantic import (
+    BaseModel, Field, GetCoreSchemaHandler, GetJsonSchemaHandler, ConfigDict, PrivateAttr,
+    ValidationError, ValidationInfo, ValidatorFunctionWrapHandler, field_validator,
+)
 from pydantic.json_schema import JsonSchemaValue
 from pydantic_core import core_schema
 from typing import Optional
 from datetime import datetime
 from bson import ObjectId
+from app.core.emotions import EMOTION_SCORES
 
 class PyObjectId(ObjectId):
     
@@ -36,11 +40,22 @@ class PyObjectId(ObjectId):
 
 # Model cho AI
 class AIAnalysis(BaseModel):
-    sentiment_score: float
-    detected_emotion: str
-    advice: str = ""
-    is_match: bool = True
-    suggested_emotion: str = ""
+    # description được đưa vào response schema gửi Gemini (ai_service.ANALYSIS_RESPONSE_SCHEMA)
+    sentiment_score: float = Field(ge=-1, le=1, description="-1.0 đến 1.0")
+    detected_emotion: str = Field(description="Cảm xúc thực sự trong nhật ký")
+    advice: str = Field(default="", description="Lời khuyên ngắn, tối đa 1 câu")
+    is_match: bool = Field(default=True, description="detected_emotion tương đồng với cảm xúc người dùng chọn")
+    suggested_emotion: str = Field(default="", description="Cảm xúc đúng nhất")
+    # Nguồn kết quả (ai | local | fallback), không trả về client và không lưu trong analysis
+    _source: str = PrivateAttr(default="ai")
+
+    @field_validator("detected_emotion", "suggested_emotion")
+    @classmethod
+    def check_emotion(cls, value: str, info: ValidationInfo) -> str:
+        # suggested_emotion được để trống (kết quả dự phòng)
+        if value in EMOTION_SCORES or (value == "" and info.field_name == "suggested_emotion"):
+            return value
+        raise ValueError(f"phải là một trong: {', '.join(EMOTION_SCORES)}")
     
 class AnalyzeJournalRequest(BaseModel):
     content: str
@@ -56,6 +71,17 @@ class JournalEntryResponse(BaseModel):
     content: str
     image_urls: List[str] = []
     analysis: Optional[AIAnalysis] = None
+
+    @field_validator("analysis", mode="wrap")
+    @classmethod
+    def keep_legacy_analysis(cls, value: Any, handler: ValidatorFunctionWrapHandler) -> Optional[AIAnalysis]:
+        # Nhật ký cũ có thể lưu analysis trước khi có ràng buộc cảm xúc/điểm: vẫn trả về nguyên trạng
+        try:
+            return handler(value)
+        except ValidationError:
+            if isinstance(value, dict):
+                return AIAnalysis.model_construct(**value)
+            raise
     
     model_config = ConfigDict(
         populate_by_name=True,
@@ -73,4 +99,24 @@ class NewEntryRequest(BaseModel):
 class UpdateEntryRequest(BaseModel):
     content: Optional[str] = None
     emotion: Optional[str] = None
-    timestamp: Optional[datetime] = None
\ No newline at end of file
+    timestamp: Optional[datetime] = None
+
+# Model cho đồng bộ offline (nhiều nhật ký một lần)
+class SyncEntry(BaseModel):
+    client_id: str = Field(..., min_length=1, max_length=128)
+    content: str
+    emotion: str
+    timestamp: datetime
+    image_urls: List[str] = []
+
+class SyncBatchRequest(BaseModel):
+    entries: List[SyncEntry] = Field(..., min_length=1, max_length=500)
+
+class SyncItemStatus(BaseModel):
+    client_id: str
+    status: str  # created | duplicate | error
+    id: Optional[str] = None
+
+class SyncBatchResponse(BaseModel):
+    results: List[SyncItemStatus]
+    analysis_queued: int
@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import date
 
 class DailyMoodData(BaseModel):
     date: date
     emotion: str
     score: int # 1 (Rất tệ) -> 5 (Rất tốt)
+    avg_score: Optional[float] = None # Trung bình các nhật ký trong ngày
 
 class MoodCountStat(BaseModel):
     emotion: str
@@ -24,4 +25,43 @@ class WeeklyStatsResponse(BaseModel):
     active_days_in_week: List[bool]
     
     # 3. Khung biểu đồ đường
-    daily_moods: List[DailyMoodData]
\ No newline at end of file
+    daily_moods: List[DailyMoodData]
+
+class TrendPoint(BaseModel):
+    date: date # Ngày đầu của nhóm (bucket_days ngày)
+    entries: int
+    mood_avg: Optional[float] = None
+    sentiment_avg: Optional[float] = None
+    mood_rolling_7: Optional[float] = None
+    mood_rolling_30: Optional[float] = None
+    sentiment_rolling_7: Optional[float] = None
+    sentiment_rolling_30: Optional[float] = None
+
+class DistributionBucket(BaseModel):
+    key: int # Thứ trong tuần (0 = Thứ 2) hoặc giờ trong ngày (0-23)
+    entries: int
+    mood_avg: Optional[float] = None
+    sentiment_avg: Optional[float] = None
+
+class EmotionMatchStat(BaseModel):
+    emotion: str
+    analyzed: int
+    match_rate: Optional[float] = None
+
+class TrendsResponse(BaseModel):
+    start_date: date
+    end_date: date
+    bucket_days: int
+    total_entries: int
+    analyzed_entries: int
+    match_rate: Optional[float] = None
+
+    # Biểu đồ xu hướng (đã gộp để không vượt quá max_points)
+    points: List[TrendPoint]
+
+    # Phân bố theo thứ và theo giờ (giờ địa phương)
+    weekday: List[DistributionBucket]
+    hourly: List[DistributionBucket]
+
+    # Cảm xúc chọn so với cảm xúc AI nhận diện
+    emotion_match: List[EmotionMatchStat]
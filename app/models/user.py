@@ -10,6 +10,7 @@ class UserProfileUpdateRequest(BaseModel):
     name: Optional[str] = None
     gender: Optional[str] = None
     birth: Optional[datetime] = None
+    timezone: Optional[str] = None  # Tên múi giờ IANA, ví dụ: Asia/Ho_Chi_Minh
     
 class UserProfileResponse(BaseModel):
     id: str = Field(alias="_id")
@@ -18,6 +19,7 @@ class UserProfileResponse(BaseModel):
     birth: Optional[datetime] = None
     email: Optional[str] = None
     picture: Optional[str] = None
+    timezone: Optional[str] = None
     
     class Config:
         validate_by_name = True
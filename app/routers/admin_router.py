@@ -0,0 +1,83 @@
+import asyncio
+from datetime import date, timedelta
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.models.admin import DailyRollup, RollupStatus, RollupRunResult
+from app.models.stat import MoodCountStat
+from app.routers.auth_dependency import require_admin_token
+from app.services.rollup_service import get_daily_rollups, get_rollup_status, run_rollup_once
+
+MAX_ROLLUP_DAYS = 366
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+
+def _rate(part: int, total: int):
+    return round(part / total, 4) if total else None
+
+
+def to_daily_rollup(doc: dict) -> DailyRollup:
+    mood_counts = doc.get("mood_counts") or {}
+    total_moods = sum(mood_counts.values())
+    mood_distribution = sorted(
+        (
+            MoodCountStat(emotion=emotion, count=count, percentage=round(count / total_moods * 100, 1))
+            for emotion, count in mood_counts.items()
+        ),
+        key=lambda x: x.count,
+        reverse=True,
+    )
+
+    sources = doc.get("analysis_sources") or {}
+    analyzed = sources.get("ai", 0) + sources.get("local", 0) + sources.get("fallback", 0)
+    score_count = doc.get("mood_score_count", 0)
+    bot_replies = doc.get("chat_bot_replies", 0)
+
+    return DailyRollup(
+        date=date.fromisoformat(doc["_id"]),
+        active_users=doc.get("active_users", 0),
+        journal_entries=doc.get("journal_entries", 0),
+        avg_mood_score=round(doc.get("mood_score_sum", 0) / score_count, 2) if score_count else None,
+        mood_distribution=mood_distribution,
+        analysis_sources=sources,
+        analysis_fallback_rate=_rate(sources.get("fallback", 0), analyzed),
+        chat_user_messages=doc.get("chat_user_messages", 0),
+        chat_bot_replies=bot_replies,
+        chat_fallbacks=doc.get("chat_fallbacks", 0),
+        chat_fallback_rate=_rate(doc.get("chat_fallbacks", 0), bot_replies),
+    )
+
+
+@router.get("/rollups/daily", response_model=List[DailyRollup])
+async def get_daily_rollup(
+    start_date: date = Query(..., description="Ngày bắt đầu (UTC)"),
+    end_date: date = Query(..., description="Ngày kết thúc (UTC)"),
+):
+    # Chỉ đọc từ daily_rollups, không quét journal_entries / chat_messages
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="Ngày bắt đầu phải trước ngày kết thúc")
+    if end_date - start_date > timedelta(days=MAX_ROLLUP_DAYS):
+        raise HTTPException(status_code=400, detail="Khoảng thời gian quá dài")
+
+    docs = get_daily_rollups(start_date.isoformat(), end_date.isoformat())
+    return [to_daily_rollup(doc) for doc in docs]
+
+
+@router.get("/rollups/status", response_model=RollupStatus)
+async def get_rollup_job_status():
+    return get_rollup_status()
+
+
+@router.post("/rollups/run", response_model=RollupRunResult)
+async def trigger_rollup():
+    # Chạy ngay một lượt; nếu worker khác đang giữ lease thì bỏ qua
+    processed = await asyncio.to_thread(run_rollup_once)
+    if processed is None:
+        return RollupRunResult(started=False)
+    return RollupRunResult(started=True, processed=processed)
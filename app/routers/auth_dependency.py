@@ -1,7 +1,9 @@
+import hmac
 from fastapi import Header, HTTPException, status, Depends
-from typing import Annotated
+from typing import Annotated, Optional
 
-from app.db.database import get_user_collection
+from app.core.config import ADMIN_TOKEN
+from app.services.profile_service import ensure_profile
 
 
 def get_current_user_id(x_user_id: Annotated[str, Header()]):
@@ -11,12 +13,19 @@ def get_current_user_id(x_user_id: Annotated[str, Header()]):
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Thiếu X-User-ID header"
         )
 
-    user_collection = get_user_collection()
-
-    user_collection.find_one_and_update(
-        {"_id": x_user_id},
-        {"$setOnInsert": {"_id": x_user_id, "name": None, "gender": None, "birth": None}},
-        upsert=True,
-    )
+    # Upsert trả về hồ sơ mới nhất và nạp luôn vào cache hồ sơ cho phần còn lại của request
+    ensure_profile(x_user_id)
 
     return x_user_id
+
+
+def require_admin_token(x_admin_token: Annotated[Optional[str], Header()] = None):
+    # Chưa cấu hình ADMIN_TOKEN thì khóa toàn bộ endpoint quản trị
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Chưa cấu hình ADMIN_TOKEN"
+        )
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="X-Admin-Token không hợp lệ"
+        )
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Query
+from typing import Optional
 from datetime import datetime
-from app.db.database import get_database
-from app.models.chat import ChatMessage, ChatRequest
+from app.db.database import get_chat_collection
+from app.models.chat import ChatMessage, ChatRequest, ChatHistoryPage, UserInfoSchema
 from app.routers.auth_dependency import get_current_user_id
-from app.services.ai_service import chat_with_bot
+from app.services.ai_service import chat_with_bot, CHAT_BUSY_REPLY
+from app.services.profile_service import get_profile
+from app.core.metrics import AI_FALLBACKS
+from app.services.admission import ai_admission
+from app.services.idempotency import run_idempotent
+from app.services.chat_history_service import (
+    get_history_page, get_recent_messages, delete_user_history, encode_cursor, decode_cursor
+)
+
+# Số tin nhắn gần nhất đưa vào ngữ cảnh chatbot
+CONTEXT_MESSAGES = 10
 
 router = APIRouter(
     prefix="/chat",
@@ -14,57 +25,101 @@ router = APIRouter(
 # Lấy collection chat_messages
 
 
+def chat_user_info(user_id: str, request: ChatRequest) -> dict:
+    # Hồ sơ trên server (đã nằm trong cache từ auth) được ưu tiên hơn user_info client gửi lên
+    profile = get_profile(user_id) or {}
+    user_info = (request.user_info or UserInfoSchema()).dict()
+    if profile.get("name"):
+        user_info["name"] = profile["name"]
+    if profile.get("gender"):
+        user_info["gender"] = profile["gender"]
+    if profile.get("birth"):
+        birth = profile["birth"]
+        user_info["birth_date"] = birth.isoformat() if isinstance(birth, datetime) else str(birth)
+    return user_info
+
+
 @router.post("/send", response_model=ChatMessage)
 async def send_message(
     request: ChatRequest,
+    idempotency_key: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
-    chat_collection = get_database()["chat_messages"]
-    cursor = chat_collection.find({"user_id": user_id}).sort("timestamp", -1).limit(10)
-    history_docs = list(cursor)[::-1] 
+    async def reply():
+        chat_collection = get_chat_collection()
+        history_docs = get_recent_messages(user_id, CONTEXT_MESSAGES)
 
-    history_gemini = []
-    for doc in history_docs:
-        role = "user" if doc["sender"] == "user" else "model"
-        msg_content = doc.get("message") or "" 
-        if msg_content:
-            history_gemini.append({"role": role, "parts": [msg_content]})
+        history_gemini = []
+        for doc in history_docs:
+            role = "user" if doc["sender"] == "user" else "model"
+            msg_content = doc.get("message") or "" 
+            if msg_content:
+                history_gemini.append({"role": role, "parts": [msg_content]})
 
-    try:
-        user_info_dict = request.user_info.dict() if request.user_info else {}
-        bot_reply_text = chat_with_bot(request.message, history_gemini, user_info_dict)
-    except Exception as e:
-        print(f"Lỗi gọi AI: {e}")
+        # Vượt giới hạn -> AdmissionRejected, trả 429 qua exception handler trong main
+        async with ai_admission.admit(user_id):
+            try:
+                bot_reply_text = await chat_with_bot(
+                    user_id, request.message, history_gemini, chat_user_info(user_id, request)
+                )
+            except Exception as e:
+                print(f"Lỗi gọi AI: {e}")
+                AI_FALLBACKS.inc(function="send_message", reason=type(e).__name__)
 
-        bot_reply_text = "Xin lỗi, hệ thống đang bận. Bạn thử lại sau nhé!"
+                bot_reply_text = CHAT_BUSY_REPLY
 
-    user_msg = ChatMessage(
-        user_id=user_id, 
-        sender="user", 
-        message=request.message, 
-        timestamp=datetime.now()
-    )
-    chat_collection.insert_one(user_msg.dict(by_alias=True, exclude={"id"}))
+        user_msg = ChatMessage(
+            user_id=user_id, 
+            sender="user", 
+            message=request.message, 
+            timestamp=datetime.now()
+        )
 
-    bot_msg = ChatMessage(
-        user_id=user_id, 
-        sender="bot", 
-        message=bot_reply_text, 
-        timestamp=datetime.now()
-    )
-    result = chat_collection.insert_one(bot_msg.dict(by_alias=True, exclude={"id"}))
+        bot_msg = ChatMessage(
+            user_id=user_id, 
+            sender="bot", 
+            message=bot_reply_text, 
+            timestamp=datetime.now()
+        )
+        # Ghi cả 2 tin nhắn trong một round trip, giữ thứ tự user -> bot
+        result = chat_collection.insert_many([
+            user_msg.dict(by_alias=True, exclude={"id"}),
+            bot_msg.dict(by_alias=True, exclude={"id"}),
+        ])
     
-    bot_msg.id = result.inserted_id
-    return bot_msg
+        bot_msg.id = result.inserted_ids[1]
+        return bot_msg.model_dump(by_alias=True)
+
+    # Client gửi lại cùng Idempotency-Key -> trả lại câu trả lời cũ, không lưu trùng tin nhắn
+    return await run_idempotent(user_id, "chat.send", idempotency_key, request.model_dump(), reply)
+
+@router.get("/history", response_model=ChatHistoryPage)
+async def get_chat_history(
+    limit: int = Query(30, ge=1, le=100, description="Số tin nhắn mỗi trang"),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    user_id: str = Depends(get_current_user_id)
+):
+    # Trang đầu là các tin nhắn mới nhất, đi dần về quá khứ (gồm cả tin nhắn đã lưu trữ)
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    messages, next_before = get_history_page(user_id, limit, before)
+    return ChatHistoryPage(
+        messages=messages,
+        next_cursor=encode_cursor(next_before) if next_before else None
+    )
 
 @router.delete("/history")
 async def clear_chat_history(user_id: str = Depends(get_current_user_id)):
-    chat_collection = get_database()["chat_messages"]
     try:
-        result = chat_collection.delete_many({"user_id": user_id})
+        deleted_count = delete_user_history(user_id)
         return {
             "message": "Đã xóa lịch sử chat thành công", 
-            "deleted_count": result.deleted_count
+            "deleted_count": deleted_count
         }
     except Exception as e:
         print(f"Lỗi xóa history: {e}")
@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Form
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Form, Header
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
 from datetime import datetime
 from bson import ObjectId
 from pymongo import ReturnDocument
 from app.db.database import get_journal_collection
 from app.models.journal import (
-    JournalEntryResponse, AnalyzeJournalRequest, AIAnalysis
+    JournalEntryResponse, AnalyzeJournalRequest, AIAnalysis,
+    SyncBatchRequest, SyncBatchResponse
 )
-from app.services.ai_service import analyze_journal_content
+from app.services.ai_service import analyze_journal_content, analyze_locally, fallback_analysis, analysis_source
+from app.services.export_service import stream_export, decode_resume_token
+from app.services.sync_service import sync_entries, analyze_pending_entries
+from app.services.idempotency import run_idempotent
+from app.services.mood_service import derived_fields, get_user_timezone, local_date_key, mood_score
+from app.services.admission import ai_admission, AdmissionRejected
+from app.core.metrics import AI_FALLBACKS
 from app.routers.auth_dependency import get_current_user_id
 
 ID_INVALID_MESSAGE = "ID không hợp lệ"
@@ -17,33 +25,67 @@ router = APIRouter(
     tags=["Journal"],
     dependencies=[Depends(get_current_user_id)]
 )
-    
+
+async def analyze_or_degrade(user_id: str, content: str, emotion: str) -> AIAnalysis:
+    # Phân loại cục bộ đủ tin cậy thì không cần xin slot / token gọi AI
+    local_analysis = analyze_locally(content, emotion)
+    if local_analysis is not None:
+        return local_analysis
+    # Khi lưu nhật ký không được làm mất dữ liệu: quá tải thì lưu kèm phân tích mặc định
+    try:
+        async with ai_admission.admit(user_id):
+            return await analyze_journal_content(content, emotion, [], try_local=False)
+    except AdmissionRejected as e:
+        AI_FALLBACKS.inc(function="analyze_journal_content", reason=e.reason)
+        return fallback_analysis()
+
 @router.post("/new", response_model=JournalEntryResponse)
 async def create_new_entry(
     content: str = Form(...),
     emotion: str = Form(...),
     timestamp: datetime = Form(...),
     image_urls: List[str] = Form(default=[]),
+    idempotency_key: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
+    async def create():
+        # 2. Phân tích cảm xúc bằng AI
+        analysis_result = await analyze_or_degrade(user_id, content, emotion)
+        
+        # 3. Tạo dữ liệu lưu vào MongoDB
+        new_entry_data = {
+            "user_id": user_id,
+            "timestamp": timestamp,
+            "emotion_selected": emotion,
+            "content": content,
+            "image_urls": image_urls,
+            "analysis": analysis_result.dict(),
+            "analysis_source": analysis_source(analysis_result),
+            **derived_fields(timestamp, emotion, get_user_timezone(user_id)),
+        }
+        collection = get_journal_collection()
+        
+        result = collection.insert_one(new_entry_data)
+        new_entry_data["_id"] = result.inserted_id
+        return new_entry_data
 
-    # 2. Phân tích cảm xúc bằng AI
-    analysis_result = await analyze_journal_content(content, emotion, [])
-    
-    # 3. Tạo dữ liệu lưu vào MongoDB
-    new_entry_data = {
-        "user_id": user_id,
-        "timestamp": timestamp,
-        "emotion_selected": emotion,
-        "content": content,
-        "image_urls": image_urls,
-        "analysis": analysis_result.dict()
-    }
-    collection = get_journal_collection()
-    
-    result = collection.insert_one(new_entry_data)
-    created_entry = collection.find_one({"_id": result.inserted_id})
-    return created_entry
+    # Client gửi lại cùng Idempotency-Key -> trả lại nhật ký đã tạo, không gọi AI lần nữa
+    payload = {"content": content, "emotion": emotion, "timestamp": timestamp, "image_urls": image_urls}
+    return await run_idempotent(user_id, "journal.new", idempotency_key, payload, create)
+
+@router.post("/sync", response_model=SyncBatchResponse)
+async def sync_offline_entries(
+    request: SyncBatchRequest,
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(get_current_user_id)
+):
+    # Ghi cả batch trong một round trip, phân tích AI chạy nền sau khi trả response
+    results = sync_entries(user_id, request.entries)
+    created = sum(1 for item in results if item.status == "created")
+    if created:
+        background_tasks.add_task(analyze_pending_entries, user_id)
+
+    return SyncBatchResponse(results=results, analysis_queued=created)
 
 @router.get("/history", response_model=List[JournalEntryResponse])
 async def get_journal_history(
@@ -82,6 +124,31 @@ async def get_first_journal_date(user_id: str = Depends(get_current_user_id)):
         return {"date": first_entry["timestamp"].date()}
     return {"date": None}
 
+@router.get("/export")
+async def export_journal(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Định dạng xuất: ndjson hoặc csv"),
+    include_chat: bool = Query(False, description="Xuất kèm tin nhắn chat"),
+    gzip: bool = Query(False, description="Nén gzip khi truyền"),
+    resume_token: Optional[str] = Query(None, description="resume_token của bản ghi cuối đã nhận"),
+    user_id: str = Depends(get_current_user_id)
+):
+    if resume_token:
+        try:
+            decode_resume_token(resume_token)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="moodpress-export.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(
+        stream_export(user_id, format, include_chat, resume_token, gzip),
+        media_type=media_type,
+        headers=headers,
+    )
+
 @router.get("/{entry_id}", response_model=JournalEntryResponse)
 async def get_single_entry(
     entry_id: str, 
@@ -118,14 +185,17 @@ async def update_entry(
 
     if content is not None:
         update_data["content"] = content
-        analysis_result = await analyze_journal_content(content, emotion or "Bình thường", [])
+        analysis_result = await analyze_or_degrade(user_id, content, emotion or "Bình thường")
         update_data["analysis"] = analysis_result.model_dump()
+        update_data["analysis_source"] = analysis_source(analysis_result)
         
     if emotion is not None:
         update_data["emotion_selected"] = emotion
+        update_data["mood_score"] = mood_score(emotion)
         
     if timestamp is not None:
         update_data["timestamp"] = timestamp
+        update_data["local_date"] = local_date_key(timestamp, get_user_timezone(user_id))
 
     update_data["image_urls"] = image_urls
 
@@ -168,10 +238,13 @@ async def analyze_journal_only(
     request: AnalyzeJournalRequest,
     user_id: str = Depends(get_current_user_id)
 ):
-    analysis_result = await analyze_journal_content(
-        request.content, 
-        request.emotion, 
-        []
-    )
+    # Người dùng chủ động xin phân tích: luôn cần lời khuyên từ Gemini
+    async with ai_admission.admit(user_id):
+        analysis_result = await analyze_journal_content(
+            request.content, 
+            request.emotion, 
+            [],
+            require_advice=True
+        )
     
     return analysis_result
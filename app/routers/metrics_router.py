@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import REGISTRY
+from app.db.monitoring import recent_slow_queries
+from app.routers.auth_dependency import require_admin_token
+
+router = APIRouter(tags=["Metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# Chứa route và dạng query: chỉ cho quản trị viên, giống /admin
+@router.get("/metrics/slow-queries", response_model=list, dependencies=[Depends(require_admin_token)])
+async def get_slow_queries():
+    return recent_slow_queries()
@@ -1,10 +1,18 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from datetime import datetime, timedelta, date, timezone
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
 
 from app.db.database import get_journal_collection
-from app.models.stat import WeeklyStatsResponse, MoodCountStat, DailyMoodData
+from app.models.stat import WeeklyStatsResponse, MoodCountStat, DailyMoodData, TrendsResponse
 from app.routers.auth_dependency import get_current_user_id
+from app.core.emotions import EMOTION_SCORES
+from app.services.mood_service import get_user_timezone, utc_offset_minutes
+from app.services.backfill_service import is_backfill_complete
+from app.services.trend_service import compute_trends, MAX_RANGE_DAYS
+
+# Đủ lớn để cả khoảng ngày về trong một batch, không phát sinh getMore
+RANGE_QUERY_BATCH_SIZE = 5000
 
 router = APIRouter(
     prefix="/stats",
@@ -13,14 +21,6 @@ router = APIRouter(
 )
 
 
-EMOTION_SCORES = {
-    "Rất tốt": 5, 
-    "Tốt": 4, 
-    "Bình thường": 3, 
-    "Tệ": 2, 
-    "Rất tệ": 1
-}
-
 # ==========================================
 # API ENDPOINTS
 # ==========================================
@@ -28,75 +28,154 @@ EMOTION_SCORES = {
 @router.get("/weekly", response_model=WeeklyStatsResponse)
 async def get_weekly_stats(
     start_date: date = Query(..., description="Ngày bắt đầu tuần (Thứ 2)"),
-    timezone_offset: int = Query(0, description="Độ lệch múi giờ của client (phút)"),
+    timezone_offset: Optional[int] = Query(None, ge=-1439, le=1439, description="Độ lệch múi giờ của client (phút), mặc định theo múi giờ trong hồ sơ"),
     user_id: str = Depends(get_current_user_id)
 ):
     end_date = start_date + timedelta(days=6)
-    
-    query_start = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
-    query_end = datetime.combine(end_date + timedelta(days=1), datetime.max.time())
-
-    collection = get_journal_collection()
-    cursor = collection.find({
-        "user_id": user_id,
-        "timestamp": {"$gte": query_start, "$lte": query_end}
-    }).sort("timestamp", 1) 
-    
-    raw_entries = list(cursor)
-
-    mood_stats, active_days, daily_moods, valid_count = process_mood_data(
-        raw_entries, start_date, end_date, timezone_offset
-    )
-    total_entries = collection.count_documents({"user_id": user_id})
-    current_streak, longest_streak = calculate_streaks(user_id, timezone_offset)
-
-    return WeeklyStatsResponse(
-        mood_counts=mood_stats,
-        current_streak=current_streak,
-        longest_streak=longest_streak,
-        total_entries=valid_count,
-        all_time_total=total_entries, 
-        active_days_in_week=active_days,
-        daily_moods=daily_moods
-    )
+    return build_range_stats(user_id, start_date, end_date, timezone_offset)
 
 @router.get("/monthly", response_model=WeeklyStatsResponse)
 async def get_monthly_stats(
     start_date: date = Query(..., description="Ngày bắt đầu"),
     end_date: date = Query(..., description="Ngày kết thúc"),
-    timezone_offset: int = Query(0, description="Độ lệch phút"),
+    timezone_offset: Optional[int] = Query(None, ge=-1439, le=1439, description="Độ lệch phút, mặc định theo múi giờ trong hồ sơ"),
     user_id: str = Depends(get_current_user_id)
 ):
-    query_start = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
-    query_end = datetime.combine(end_date + timedelta(days=1), datetime.max.time())
+    return build_range_stats(user_id, start_date, end_date, timezone_offset)
+
+@router.get("/trends", response_model=TrendsResponse)
+async def get_mood_trends(
+    start_date: date = Query(..., description="Ngày bắt đầu"),
+    end_date: date = Query(..., description="Ngày kết thúc"),
+    max_points: int = Query(120, ge=10, le=500, description="Số điểm tối đa trên biểu đồ"),
+    timezone_offset: Optional[int] = Query(None, ge=-1439, le=1439, description="Độ lệch phút, mặc định theo múi giờ trong hồ sơ"),
+    user_id: str = Depends(get_current_user_id)
+):
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="Ngày bắt đầu phải trước ngày kết thúc")
+    if (end_date - start_date).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail="Khoảng thời gian quá dài")
+
+    if timezone_offset is None:
+        tz = get_user_timezone(user_id)
+    else:
+        tz = timezone(timedelta(minutes=timezone_offset))
+    return compute_trends(user_id, start_date, end_date, tz, max_points)
+
+
+# ==========================================
+# HELPER FUNCTIONS
+# ==========================================
 
+def build_range_stats(
+    user_id: str,
+    start_date: date,
+    end_date: date,
+    timezone_offset: Optional[int]
+) -> WeeklyStatsResponse:
     collection = get_journal_collection()
-    cursor = collection.find({
-        "user_id": user_id,
-        "timestamp": {"$gte": query_start, "$lte": query_end}
-    }).sort("timestamp", 1)
-    
-    raw_entries = list(cursor)
-    mood_stats, active_days, daily_moods, valid_count = process_mood_data(
-        raw_entries, start_date, end_date, timezone_offset
+    tz = get_user_timezone(user_id)
+
+    # local_date/mood_score đã tính sẵn theo múi giờ trong hồ sơ: chỉ dùng khi client
+    # không gửi offset khác và mọi bản ghi cũ đã được backfill
+    use_precomputed = is_backfill_complete() and (
+        timezone_offset is None or timezone_offset == utc_offset_minutes(tz)
     )
-    current_streak, longest_streak = calculate_streaks(user_id, timezone_offset)
-    total_entries = collection.count_documents({"user_id": user_id})
+
+    if use_precomputed:
+        mood_stats, active_days, daily_moods, valid_count = load_precomputed_mood_data(
+            user_id, start_date, end_date
+        )
+        current_streak, longest_streak = calculate_precomputed_streaks(user_id, tz)
+    else:
+        if timezone_offset is None:
+            timezone_offset = utc_offset_minutes(tz)
+        query_start = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
+        query_end = datetime.combine(end_date + timedelta(days=1), datetime.max.time())
+        entries = list(collection.find(
+            {"user_id": user_id, "timestamp": {"$gte": query_start, "$lte": query_end}},
+            {"_id": 0, "timestamp": 1, "emotion_selected": 1}
+        ).batch_size(RANGE_QUERY_BATCH_SIZE))
+        mood_stats, active_days, daily_moods, valid_count = process_mood_data(
+            entries, start_date, end_date, timezone_offset
+        )
+        current_streak, longest_streak = calculate_streaks(user_id, timezone_offset)
+
+    all_time_total = collection.count_documents({"user_id": user_id})
 
     return WeeklyStatsResponse(
         mood_counts=mood_stats,
         current_streak=current_streak,
         longest_streak=longest_streak,
         total_entries=valid_count,
-        all_time_total=total_entries,
+        all_time_total=all_time_total,
         active_days_in_week=active_days,
         daily_moods=daily_moods
     )
 
 
-# ==========================================
-# HELPER FUNCTIONS
-# ==========================================
+def load_precomputed_mood_data(
+    user_id: str,
+    start_date: date,
+    end_date: date
+) -> Tuple[List[MoodCountStat], List[bool], List[DailyMoodData], int]:
+    collection = get_journal_collection()
+    pipeline = [
+        {"$match": {
+            "user_id": user_id,
+            "local_date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
+        }},
+        {"$project": {
+            "_id": 0,
+            "local_date": 1,
+            "timestamp": 1,
+            "mood_score": 1,
+            "emotion": {"$ifNull": ["$emotion_selected", "Bình thường"]}
+        }},
+        {"$sort": {"local_date": 1, "timestamp": 1}},
+        {"$facet": {
+            "daily": [
+                {"$group": {
+                    "_id": "$local_date",
+                    "emotion": {"$last": "$emotion"},
+                    "score": {"$last": "$mood_score"},
+                    "avg_score": {"$avg": "$mood_score"}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "counts": [
+                {"$group": {"_id": "$emotion", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ]
+        }}
+    ]
+    result = next(collection.aggregate(pipeline), {"daily": [], "counts": []})
+
+    total_days = (end_date - start_date).days + 1
+    active_days = [False] * total_days
+    daily_moods_list = []
+    for day in result["daily"]:
+        local_date = date.fromisoformat(day["_id"])
+        active_days[(local_date - start_date).days] = True
+        daily_moods_list.append(DailyMoodData(
+            date=local_date,
+            emotion=day["emotion"],
+            score=day["score"],
+            avg_score=round(day["avg_score"], 2)
+        ))
+
+    valid_entries_count = sum(item["count"] for item in result["counts"])
+    mood_stats = [
+        MoodCountStat(
+            emotion=item["_id"],
+            count=item["count"],
+            percentage=round((item["count"] / valid_entries_count) * 100, 1)
+        )
+        for item in result["counts"]
+    ]
+
+    return mood_stats, active_days, daily_moods_list, valid_entries_count
+
 
 def process_mood_data(
     entries: List[dict], 
@@ -127,10 +206,13 @@ def process_mood_data(
             
             active_days[delta_days] = True
             
+            day_scores = daily_mood_map.get(delta_days, {}).get("scores", [])
+            day_scores.append(EMOTION_SCORES.get(emotion, 3))
             daily_mood_map[delta_days] = {
                 "date": local_date,
                 "emotion": emotion,
-                "score": EMOTION_SCORES.get(emotion, 3)
+                "score": EMOTION_SCORES.get(emotion, 3),
+                "scores": day_scores
             }
             
             if emotion in mood_counter:
@@ -141,7 +223,9 @@ def process_mood_data(
     daily_moods_list = []
     for i in range(total_days):
         if i in daily_mood_map:
-            daily_moods_list.append(DailyMoodData(**daily_mood_map[i]))
+            day = daily_mood_map[i]
+            scores = day.pop("scores")
+            daily_moods_list.append(DailyMoodData(**day, avg_score=round(sum(scores) / len(scores), 2)))
 
     mood_stats = []
     if valid_entries_count > 0:
@@ -158,18 +242,41 @@ def process_mood_data(
 
 
 def calculate_streaks(user_id: str, timezone_offset: int) -> Tuple[int, int]:
+    # Gom ngày địa phương trên server thành một document: một round trip dù user có bao nhiêu nhật ký
     collection = get_journal_collection()
-    cursor = collection.find(
-        {"user_id": user_id},
-        {"timestamp": 1, "_id": 0}
-    ).sort("timestamp", 1)
-
-    local_dates_set = set()
-    for doc in cursor:
-        utc_ts = doc["timestamp"]
-        local_ts = utc_ts + timedelta(minutes=timezone_offset)
-        local_dates_set.add(local_ts.date())
+    sign = "+" if timezone_offset >= 0 else "-"
+    hours, minutes = divmod(abs(timezone_offset), 60)
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "dates": {"$addToSet": {"$dateToString": {
+                "format": "%Y-%m-%d",
+                "date": "$timestamp",
+                "timezone": f"{sign}{hours:02d}:{minutes:02d}"
+            }}}
+        }}
+    ]
+    result = next(collection.aggregate(pipeline), {"dates": []})
+    local_dates_set = {date.fromisoformat(value) for value in result["dates"] if value}
 
+    user_now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=timezone_offset)
+    return streaks_from_dates(local_dates_set, user_now.date())
+
+
+def calculate_precomputed_streaks(user_id: str, tz: ZoneInfo) -> Tuple[int, int]:
+    # distinct trên index {user_id, local_date}: không phải đọc từng bản ghi
+    collection = get_journal_collection()
+    local_dates_set = {
+        date.fromisoformat(value)
+        for value in collection.distinct("local_date", {"user_id": user_id})
+        if value
+    }
+    user_today = datetime.now(tz).date()
+    return streaks_from_dates(local_dates_set, user_today)
+
+
+def streaks_from_dates(local_dates_set: Set[date], user_today: date) -> Tuple[int, int]:
     sorted_dates = sorted(local_dates_set)
 
     if not sorted_dates:
@@ -190,8 +297,6 @@ def calculate_streaks(user_id: str, timezone_offset: int) -> Tuple[int, int]:
         longest_streak = current_run
 
     # 2. Current Streak
-    user_now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=timezone_offset)
-    user_today = user_now.date()
     user_yesterday = user_today - timedelta(days=1)
 
     current_streak = 0
@@ -1,9 +1,13 @@
-from http.client import HTTPException
 import os
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from app.db.database import get_user_collection, get_journal_collection
 from app.models.user import UserProfileResponse, UserProfileUpdateRequest
 from app.routers.auth_dependency import get_current_user_id
+from app.services.mood_service import is_valid_timezone
+from app.services.profile_service import (
+    get_profile, update_profile, invalidate_profile, new_generation, new_user_fields,
+)
+from app.services.backfill_service import recompute_user_local_dates
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from pydantic import BaseModel
@@ -24,8 +28,7 @@ router = APIRouter(
 
 @router.get("/profile", response_model=UserProfileResponse)
 async def get_user_profile(user_id: str = Depends(get_current_user_id)):
-    user_collection = get_user_collection()
-    user = user_collection.find_one({"_id": user_id})
+    user = get_profile(user_id)
     if user:
         return user
     raise HTTPException(status_code=404, detail="Không tìm thấy user")
@@ -33,21 +36,24 @@ async def get_user_profile(user_id: str = Depends(get_current_user_id)):
 @router.put("/profile", response_model=UserProfileResponse)
 async def update_user_profile(
     request: UserProfileUpdateRequest, 
+    background_tasks: BackgroundTasks,
     user_id: str = Depends(get_current_user_id)
 ):
-    user_collection = get_user_collection()
     update_data = request.dict(exclude_unset=True)
     
     if not update_data:
         raise HTTPException(status_code=400, detail="Không có thông tin cập nhật")
+
+    if "timezone" in update_data and update_data["timezone"] and not is_valid_timezone(update_data["timezone"]):
+        raise HTTPException(status_code=400, detail="Múi giờ không hợp lệ")
     
-    updated_user = user_collection.find_one_and_update(
-        {"_id": user_id}, 
-        {"$set": update_data}, 
-        return_document=True 
-    )
+    # Ghi xuyên cache: persona chat và múi giờ đọc lại từ hồ sơ mới ở lượt sau
+    updated_user = update_profile(user_id, update_data)
     
     if updated_user:
+        if "timezone" in update_data:
+            # local_date của nhật ký cũ tính theo múi giờ trước đó
+            background_tasks.add_task(recompute_user_local_dates, user_id)
         return updated_user
     raise HTTPException(status_code=404, detail="Không tìm thấy user khi đang cập nhật")
 
@@ -103,7 +109,7 @@ async def link_google_account(
             
             user_collection.update_one(
                 {"_id": google_user_id},
-                {"$set": update_fields}
+                {"$set": update_fields, "$inc": {"version": 1}}
             )
             
             user_collection.delete_one({"_id": current_user_id})
@@ -112,6 +118,7 @@ async def link_google_account(
             if current_temp_user:
                 new_user_data = current_temp_user.copy()
                 new_user_data["_id"] = google_user_id
+                new_user_data["generation"] = new_generation()
                 new_user_data["email"] = email
                 new_user_data["picture"] = picture
                 
@@ -119,12 +126,16 @@ async def link_google_account(
                 user_collection.delete_one({"_id": current_user_id})
             else:
                 user_collection.insert_one({
+                    **new_user_fields(),
                     "_id": google_user_id,
                     "email": email,
                     "picture": picture,
                     "name": id_info.get('name')
                 })
 
+        invalidate_profile(current_user_id)
+        invalidate_profile(google_user_id)
+
         return {
             "message": "Liên kết thành công",
             "new_id": google_user_id,
@@ -0,0 +1,180 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque
+
+from cachetools import TTLCache
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.core.config import (
+    AI_RATE_PER_MINUTE, AI_BURST, AI_MAX_IN_FLIGHT, AI_MAX_QUEUE, AI_QUEUE_TIMEOUT_SECONDS,
+)
+from app.core.metrics import (
+    AI_ADMISSION_REJECTED, AI_ADMISSION_QUEUED, AI_ADMISSION_WAIT, AI_IN_FLIGHT, AI_QUEUE_DEPTH,
+)
+
+MAX_TRACKED_USERS = 100_000
+
+REJECT_MESSAGES = {
+    "rate_limited": "Bạn gửi yêu cầu quá nhanh, vui lòng thử lại sau ít phút.",
+    "queue_full": "Hệ thống đang quá tải, vui lòng thử lại sau.",
+    "queue_timeout": "Hệ thống đang quá tải, vui lòng thử lại sau.",
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = REJECT_MESSAGES.get(reason, REJECT_MESSAGES["queue_full"])
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        rate_per_minute: float,
+        burst: int,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        # Bucket đã hồi đầy thì tương đương bucket mới, nên có thể bỏ khỏi cache
+        refill_seconds = burst / self.rate if self.rate > 0 else 3600
+        self._buckets: TTLCache = TTLCache(maxsize=MAX_TRACKED_USERS, ttl=refill_seconds, timer=clock)
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    # ---------- Token bucket theo user ----------
+
+    def _take_token(self, user_id: str):
+        now = self._clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(float(self.burst), now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens < 1:
+            self._buckets[user_id] = bucket
+            retry_after = (1 - bucket.tokens) / self.rate if self.rate > 0 else 60.0
+            raise AdmissionRejected("rate_limited", retry_after)
+
+        bucket.tokens -= 1
+        self._buckets[user_id] = bucket
+
+    def _refund_token(self, user_id: str):
+        bucket = self._buckets.get(user_id)
+        if bucket is not None:
+            bucket.tokens = min(self.burst, bucket.tokens + 1)
+
+    # ---------- Giới hạn số lời gọi đồng thời ----------
+
+    async def _acquire_slot(self):
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            AI_IN_FLIGHT.set(self._in_flight)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected("queue_full", self.queue_timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        AI_ADMISSION_QUEUED.inc()
+        AI_QUEUE_DEPTH.set(len(self._waiters))
+        start = self._clock()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return
+            raise AdmissionRejected("queue_timeout", self.queue_timeout)
+        except asyncio.CancelledError:
+            # Slot có thể đã được chuyển cho request này ngay trước khi bị hủy
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            AI_QUEUE_DEPTH.set(len(self._waiters))
+            AI_ADMISSION_WAIT.observe(self._clock() - start)
+
+    def _release_slot(self):
+        # Chuyển thẳng slot cho request đang chờ, không giảm _in_flight
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                AI_QUEUE_DEPTH.set(len(self._waiters))
+                return
+        self._in_flight -= 1
+        AI_IN_FLIGHT.set(self._in_flight)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        try:
+            self._take_token(user_id)
+            try:
+                await self._acquire_slot()
+            except AdmissionRejected:
+                self._refund_token(user_id)
+                raise
+        except AdmissionRejected as e:
+            AI_ADMISSION_REJECTED.inc(reason=e.reason)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+    @asynccontextmanager
+    async def slot(self):
+        # Cho job nền: chỉ chiếm slot toàn cục, không trừ token của user
+        try:
+            await self._acquire_slot()
+        except AdmissionRejected as e:
+            AI_ADMISSION_REJECTED.inc(reason=e.reason)
+            raise
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+
+ai_admission = AdmissionController(
+    rate_per_minute=AI_RATE_PER_MINUTE,
+    burst=AI_BURST,
+    max_in_flight=AI_MAX_IN_FLIGHT,
+    max_queue=AI_MAX_QUEUE,
+    queue_timeout=AI_QUEUE_TIMEOUT_SECONDS,
+)
+
+
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
@@ -1,13 +1,31 @@
 import google.generativeai as genai
 import os
-import json
 import httpx
 from PIL import Image
-import re
 import io
+import asyncio
+import time
+from cachetools import TTLCache
+from pydantic import ValidationError
+from google.generativeai import caching
 from app.models.journal import AIAnalysis
+from app.core.metrics import (
+    track, AI_CALL_DURATION, AI_IMAGE_FETCH_DURATION, AI_FALLBACKS, AI_PROMPT_TOKENS, AI_CACHED_PROMPT_TOKENS,
+    AI_PARSE_FAILURES, LOCAL_ANALYSES, LOCAL_CLASSIFIER_DURATION,
+)
+from app.core.config import (
+    AI_TIMEOUT_SECONDS, AI_RETRY_ATTEMPTS, AI_RETRY_BASE_DELAY_SECONDS, AI_RETRY_MAX_DELAY_SECONDS,
+    AI_HEDGE_DELAY_SECONDS, AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_SECONDS,
+    AI_FAKE_MODEL, AI_FAKE_LATENCY_SECONDS, AI_FAKE_FAILURE_RATE,
+    AI_CONTEXT_CACHE_ENABLED, AI_CONTEXT_CACHE_TTL_SECONDS, PERSONA_CACHE_TTL_SECONDS,
+    LOCAL_CLASSIFIER_ENABLED, LOCAL_CLASSIFIER_MIN_CONFIDENCE,
+)
+from app.services.resilience import CircuitBreaker, retry_with_jitter, hedged
+from app.services.fake_model import FakeGenerativeModel
+from app.services.local_classifier import classify
+from app.core.emotions import EMOTION_SCORES
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 
 load_dotenv()
 
@@ -22,39 +40,141 @@ system_instruction = """
     3. Nếu người dùng có dấu hiệu trầm cảm nặng hoặc muốn làm hại bản thân, hãy khuyên họ tìm kiếm sự giúp đỡ chuyên nghiệp ngay lập tức một cách khéo léo.
     4. Câu trả lời ngắn gọn, súc tích, tránh viết quá dài dòng như một bài giảng.
     """
-    
+
+# Phần cố định của prompt chat: nằm trong system instruction để được cache (implicit
+# hoặc context cache), không gửi kèm từng tin nhắn nữa
+chat_instruction = system_instruction + (
+    "Nếu người dùng hỏi ngoài hoạt động tâm lý, hãy lịch sự từ chối và hướng họ quay lại chủ đề tâm trạng. "
+    "Bạn là người bạn đồng hành thấu hiểu. Hãy xưng hô thân mật, phù hợp với tuổi và giới tính người dùng. "
+    "Quy tắc trả lời:\n"
+    "1. Ngắn gọn, ấm áp.\n"
+    "2. Nếu người dùng buồn/tiêu cực: Gọi tên họ và gợi ý cụ thể tên bài hát (kèm ca sĩ) phù hợp với độ tuổi để xoa dịu.\n"
+    "3. Nếu tiêu cực nặng (tuyệt vọng, hoảng loạn): Hướng dẫn kỹ thuật bình ổn cảm xúc (như hít thở) hoặc khuyên tìm chuyên gia tâm lý."
+)
+
+MODEL_NAME = 'models/gemini-2.5-flash'
+
+EMOTION_FIELDS = ("detected_emotion", "suggested_emotion")
+
+def analysis_response_schema() -> dict:
+    # Sinh từ AIAnalysis: Gemini chỉ nhận schema dạng dict (type/properties/enum/required),
+    # không nhận trực tiếp model pydantic vì có "default"/"title"
+    properties = {}
+    for name, field in AIAnalysis.model_json_schema()["properties"].items():
+        prop = {"type": field.get("type", "string")}
+        if "description" in field:
+            prop["description"] = field["description"]
+        if name in EMOTION_FIELDS:
+            prop["enum"] = list(EMOTION_SCORES)
+        properties[name] = prop
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+ANALYSIS_RESPONSE_SCHEMA = analysis_response_schema()
+
 # Khởi tạo model
-model_json = genai.GenerativeModel('models/gemini-2.5-flash', system_instruction=system_instruction, generation_config={"response_mime_type": "application/json"})
-model_text = genai.GenerativeModel('models/gemini-2.5-flash', system_instruction=system_instruction)
-def clean_json_string(json_str: str) -> str:
-    # Tìm chuỗi bắt đầu bằng { và kết thúc bằng } (kể cả xuống dòng)
-    match = re.search(r'\{.*\}', json_str, re.DOTALL)
-    if match:
-        return match.group(0)
-    return json_str.strip()
+model_json = genai.GenerativeModel(
+    MODEL_NAME,
+    system_instruction=system_instruction,
+    generation_config={"response_mime_type": "application/json", "response_schema": ANALYSIS_RESPONSE_SCHEMA},
+)
+model_text = genai.GenerativeModel(MODEL_NAME, system_instruction=chat_instruction)
+
+if AI_FAKE_MODEL:
+    model_json = FakeGenerativeModel(AI_FAKE_LATENCY_SECONDS, AI_FAKE_FAILURE_RATE, json_mode=True)
+    model_text = FakeGenerativeModel(AI_FAKE_LATENCY_SECONDS, AI_FAKE_FAILURE_RATE)
+
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=AI_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=AI_BREAKER_RESET_SECONDS,
+)
+
+def record_token_usage(function: str, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    AI_PROMPT_TOKENS.observe(prompt_tokens, function=function)
+    if cached_tokens:
+        AI_CACHED_PROMPT_TOKENS.inc(cached_tokens, function=function)
+
+async def call_gemini(function: str, make_call):
+    # Circuit mở -> CircuitOpen ngay lập tức, caller trả về kết quả mặc định mà không chờ timeout
+    async def attempt():
+        with track(AI_CALL_DURATION, "ai", function=function):
+            response = await asyncio.wait_for(make_call(), AI_TIMEOUT_SECONDS)
+        record_token_usage(function, response)
+        return response
+
+    async def hedged_attempt():
+        if AI_HEDGE_DELAY_SECONDS > 0:
+            return await hedged(attempt, function, AI_HEDGE_DELAY_SECONDS)
+        return await attempt()
+
+    return await gemini_breaker.call(
+        lambda: retry_with_jitter(
+            hedged_attempt, function, AI_RETRY_ATTEMPTS,
+            AI_RETRY_BASE_DELAY_SECONDS, AI_RETRY_MAX_DELAY_SECONDS,
+        )
+    )
+
+def fallback_analysis() -> AIAnalysis:
+    analysis = AIAnalysis(sentiment_score=0.0, detected_emotion="Bình thường", advice="")
+    analysis._source = "fallback"
+    return analysis
+
+# Câu trả lời mặc định khi không gọi được AI, dùng để đếm tỉ lệ fallback của chat
+CHAT_FALLBACK_REPLY = "Xin lỗi, mình đang gặp chút khó khăn khi kết nối. Bạn thử lại sau nhé!"
+CHAT_BUSY_REPLY = "Xin lỗi, hệ thống đang bận. Bạn thử lại sau nhé!"
+CHAT_FALLBACK_MESSAGES = {CHAT_FALLBACK_REPLY, CHAT_BUSY_REPLY}
+
+def analysis_source(analysis) -> str:
+    # "ai" | "local" | "fallback" | "none"; với dict cũ: kết quả AI thật luôn có suggested_emotion
+    if analysis is None:
+        return "none"
+    if isinstance(analysis, AIAnalysis):
+        return analysis._source
+    if analysis == fallback_analysis().model_dump():
+        return "fallback"
+    return "ai"
 
 def get_optimized_image_url(url: str) -> str:
     if "cloudinary.com" in url and "/upload/" in url:
         return url.replace("/upload/", "/upload/w_200/")
     return url
 
-async def analyze_journal_content(content: str, selected_emotion: str, image_urls: list[str] = []) -> AIAnalysis:
+def analyze_locally(content: str, selected_emotion: str, image_urls: list[str] = [], require_advice: bool = False):
+    # Nhật ký ngắn, rõ cảm xúc: phân loại tại chỗ trong vài mili giây thay vì chờ Gemini.
+    # Cần lời khuyên hoặc có ảnh thì bộ phân loại cục bộ không thay được Gemini
+    if not LOCAL_CLASSIFIER_ENABLED or require_advice or image_urls:
+        return None
+    with track(LOCAL_CLASSIFIER_DURATION, "local_classifier"):
+        result = classify(content, selected_emotion)
+    if result.confidence < LOCAL_CLASSIFIER_MIN_CONFIDENCE:
+        LOCAL_ANALYSES.inc(outcome="escalated")
+        return None
+    LOCAL_ANALYSES.inc(outcome="local")
+    result.analysis._source = "local"
+    return result.analysis
+
+async def analyze_journal_content(
+    content: str,
+    selected_emotion: str,
+    image_urls: list[str] = [],
+    require_advice: bool = False,
+    try_local: bool = True,
+) -> AIAnalysis:
+    # try_local=False khi caller đã thử analyze_locally trước lúc xin slot gọi AI
+    if try_local:
+        local_analysis = analyze_locally(content, selected_emotion, image_urls, require_advice)
+        if local_analysis is not None:
+            return local_analysis
+
     try:
-        # Sửa Prompt
-        prompt = f"""
-        Bạn là một chuyên gia tâm lý. Phân tích nhật ký sau. Người dùng chọn cảm xúc: "{selected_emotion}".
-        Nội dung: "{content}"
-        
-        Yêu cầu:
-        1. detected_emotion: Cảm xúc thực sự (Rất tốt/Tốt/Bình thường/Tệ/Rất tệ).
-        2. sentiment_score: -1.0 đến 1.0.
-        3. is_match: true nếu detected_emotion tương đồng với "{selected_emotion}", ngược lại false.
-        4. suggested_emotion: Đề xuất cảm xúc đúng nhất (nếu is_match=false).
-        5. advice: Lời khuyên hoặc chia sẻ ngắn gọn (tối đa 1 câu).
-        
-        Trả về đúng cấu trúc JSON này.
-        """
-        
+        # Tên trường, thang điểm và danh sách cảm xúc đã nằm trong ANALYSIS_RESPONSE_SCHEMA
+        prompt = f'Phân tích nhật ký. Người dùng chọn cảm xúc: "{selected_emotion}".\nNội dung: "{content}"'
+
         input_parts = [prompt]
 
         if image_urls:
@@ -63,31 +183,46 @@ async def analyze_journal_content(content: str, selected_emotion: str, image_url
                     try:
                         optimized_url = get_optimized_image_url(url)
                         print(f"AI loading image: {optimized_url}")
-                        resp = await client.get(optimized_url, timeout=10.0)
+                        with track(AI_IMAGE_FETCH_DURATION, "image"):
+                            resp = await client.get(optimized_url, timeout=10.0)
                         if resp.status_code == 200:
                             img = Image.open(io.BytesIO(resp.content))
                             input_parts.append(img)
                     except Exception as e:
                         print(f"Lỗi tải ảnh AI: {e}")
 
-        response = model_json.generate_content(input_parts)
-        
-        raw_text = response.text
-        cleaned_text = clean_json_string(raw_text)
-        
-        data = json.loads(cleaned_text)
-        
-        return AIAnalysis(
-            sentiment_score=data.get("sentiment_score") or 0.0,
-            detected_emotion=data.get("detected_emotion") or "Bình thường",
-            advice=data.get("advice") or "",
-            is_match=data.get("is_match") if data.get("is_match") is not None else True,
-            suggested_emotion=data.get("suggested_emotion") or selected_emotion
+        response = await call_gemini(
+            "analyze_journal_content", lambda: model_json.generate_content_async(input_parts)
         )
+        analysis = await parse_analysis(response.text, input_parts)
+        if not analysis.suggested_emotion:
+            analysis.suggested_emotion = selected_emotion
+        return analysis
 
     except Exception as e:
         print(f"Lỗi AI: {e}")
-        return AIAnalysis(sentiment_score=0.0, detected_emotion="Bình thường", advice="")
+        AI_FALLBACKS.inc(function="analyze_journal_content", reason=type(e).__name__)
+        return fallback_analysis()
+
+async def parse_analysis(raw_text: str, input_parts: list) -> AIAnalysis:
+    # Validate một lần bằng AIAnalysis; sai schema thì gửi lại đúng lỗi cho Gemini sửa, chỉ một lần
+    try:
+        return AIAnalysis.model_validate_json(raw_text)
+    except ValidationError as e:
+        AI_PARSE_FAILURES.inc(function="analyze_journal_content", stage="initial")
+        errors = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'root'}: {err['msg']}" for err in e.errors())
+
+    repair_parts = input_parts + [
+        f"Phản hồi trước không hợp lệ: {raw_text[:1000]}\nLỗi: {errors}\nTrả lại JSON đã sửa theo đúng schema."
+    ]
+    response = await call_gemini(
+        "analyze_journal_content_repair", lambda: model_json.generate_content_async(repair_parts)
+    )
+    try:
+        return AIAnalysis.model_validate_json(response.text)
+    except ValidationError:
+        AI_PARSE_FAILURES.inc(function="analyze_journal_content", stage="repair")
+        raise
 
 def calculate_age(birth_date_str: str) -> int:
     try:
@@ -103,28 +238,78 @@ def calculate_age(birth_date_str: str) -> int:
         print(f"Lỗi tính tuổi: {e}")
         return 0
     
-def chat_with_bot(user_message: str, history: list, user_info: dict) -> str:
+# Persona theo user: chỉ tính tuổi / dựng chuỗi một lần; hồ sơ đổi thì key đổi và persona được dựng lại
+_persona_cache: TTLCache = TTLCache(maxsize=10_000, ttl=PERSONA_CACHE_TTL_SECONDS)
+
+def build_persona(user_info: dict) -> str:
+    name = user_info.get("name", "Bạn")
+    gender = user_info.get("gender", "bạn")
+    birth_date = user_info.get("birth_date", "")
+    age = calculate_age(birth_date) if birth_date else "không rõ"
+    return f"Thông tin người dùng: Tên {name}, {age} tuổi, giới tính {gender}."
+
+def get_persona_turns(user_id: str, user_info: dict) -> list:
+    key = (user_info.get("name"), user_info.get("gender"), user_info.get("birth_date"))
+    cached = _persona_cache.get(user_id)
+    if cached is None or cached[0] != key:
+        # Persona là lượt đầu của hội thoại: system instruction giữ nguyên cho mọi user
+        turns = [
+            {"role": "user", "parts": [build_persona(user_info)]},
+            {"role": "model", "parts": ["Mình đã ghi nhớ thông tin của bạn."]},
+        ]
+        cached = (key, turns)
+        _persona_cache[user_id] = cached
+    return cached[1]
+
+# Context cache của Gemini cho chat_instruction; tạo lại khi sắp hết hạn
+_context_cache = {"model": None, "expires_at": 0.0, "retry_at": 0.0}
+_context_cache_lock = asyncio.Lock()
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 60
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+def _create_cached_chat_model():
+    cache = caching.CachedContent.create(
+        model=MODEL_NAME,
+        display_name="moodpress-chat-instruction",
+        system_instruction=chat_instruction,
+        ttl=timedelta(seconds=AI_CONTEXT_CACHE_TTL_SECONDS),
+    )
+    return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+async def get_chat_model():
+    if not AI_CONTEXT_CACHE_ENABLED or AI_FAKE_MODEL:
+        return model_text
+    now = time.monotonic()
+    if _context_cache["model"] is not None and now < _context_cache["expires_at"] - CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+        return _context_cache["model"]
+    if now < _context_cache["retry_at"]:
+        return model_text
+
+    async with _context_cache_lock:
+        if _context_cache["model"] is not None and now < _context_cache["expires_at"] - CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+            return _context_cache["model"]
+        try:
+            model = await asyncio.to_thread(_create_cached_chat_model)
+        except Exception as e:
+            # Prompt quá ngắn so với mức tối thiểu hoặc model không hỗ trợ: dùng system instruction thường
+            print(f"Không tạo được context cache, dùng system instruction: {e}")
+            _context_cache.update(model=None, retry_at=now + CONTEXT_CACHE_RETRY_SECONDS)
+            return model_text
+        _context_cache.update(model=model, expires_at=now + AI_CONTEXT_CACHE_TTL_SECONDS)
+        return model
+
+async def chat_with_bot(user_id: str, user_message: str, history: list, user_info: dict) -> str:
     try:
-        name = user_info.get("name", "Bạn")
-        gender = user_info.get("gender", "bạn")
-        birth_date = user_info.get("birth_date", "")
-        
-        age = calculate_age(birth_date) if birth_date else "không rõ"
-        
-        chat = model_text.start_chat(history=history)
-        
-        system_instruction = (
-           f"Thông tin người dùng: Tên {name}, {age} tuổi, giới tính {gender}. "
-            "Nếu người dùng hỏi ngoài hoạt động tâm lý, hãy lịch sự từ chối và hướng họ quay lại chủ đề tâm trạng. "
-            "Bạn là người bạn đồng hành thấu hiểu. Hãy xưng hô thân mật, phù hợp với tuổi và giới tính người dùng. "
-            "Quy tắc trả lời:\n"
-            "1. Ngắn gọn, ấm áp.\n"
-            "2. Nếu người dùng buồn/tiêu cực: Gọi tên họ và gợi ý cụ thể tên bài hát (kèm ca sĩ) phù hợp với độ tuổi để xoa dịu.\n"
-            "3. Nếu tiêu cực nặng (tuyệt vọng, hoảng loạn): Hướng dẫn kỹ thuật bình ổn cảm xúc (như hít thở) hoặc khuyên tìm chuyên gia tâm lý."
+        chat_model = await get_chat_model()
+        full_history = get_persona_turns(user_id, user_info) + history
+        # Mỗi lần thử (retry/hedge) dùng một chat session riêng để không ghi lặp vào history
+        response = await call_gemini(
+            "chat_with_bot",
+            lambda: chat_model.start_chat(history=full_history).send_message_async(user_message),
         )
-        response = chat.send_message(f"{system_instruction}\nUser: {user_message}")
         return response.text
-    except Exception:
-        return "Xin lỗi, mình đang gặp chút khó khăn khi kết nối. Bạn thử lại sau nhé!"
+    except Exception as e:
+        AI_FALLBACKS.inc(function="chat_with_bot", reason=type(e).__name__)
+        return CHAT_FALLBACK_REPLY
     
     
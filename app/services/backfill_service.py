@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from app.core.config import BACKFILL_BATCH_SIZE, BACKFILL_PAUSE_SECONDS, DEFAULT_TIMEZONE
+from app.db.database import get_journal_collection, get_user_collection, get_migration_collection
+from app.services.mood_service import derived_fields, resolve_timezone
+from app.services.job_lease import acquire_lease, renew_lease
+
+MIGRATION_ID = "journal_local_date"
+LEASE_SECONDS = 60
+COMPLETE_CHECK_INTERVAL_SECONDS = 60
+
+_complete = False
+_complete_checked_at: Optional[datetime] = None
+
+MISSING_FIELDS = {"$or": [{"local_date": {"$exists": False}}, {"mood_score": {"$exists": False}}]}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def is_backfill_complete() -> bool:
+    # Stats chỉ dùng local_date khi mọi bản ghi cũ đã được backfill
+    global _complete, _complete_checked_at
+    if _complete:
+        return True
+    now = _now()
+    if _complete_checked_at and (now - _complete_checked_at).total_seconds() < COMPLETE_CHECK_INTERVAL_SECONDS:
+        return False
+    _complete_checked_at = now
+    state = get_migration_collection().find_one({"_id": MIGRATION_ID}, {"done": 1})
+    _complete = bool(state and state.get("done"))
+    return _complete
+
+
+def _acquire_lease() -> Optional[dict]:
+    # Nhiều worker cùng khởi động: chỉ một worker chạy backfill tại một thời điểm
+    return acquire_lease(
+        get_migration_collection(), MIGRATION_ID, LEASE_SECONDS,
+        on_insert={"done": False, "last_id": None},
+        extra_filter={"done": False},
+    )
+
+
+def backfill_batch(last_id) -> tuple:
+    journal = get_journal_collection()
+    query = dict(MISSING_FIELDS)
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+    docs = list(journal.find(query, {"user_id": 1, "timestamp": 1, "emotion_selected": 1})
+                .sort("_id", 1).limit(BACKFILL_BATCH_SIZE))
+    if not docs:
+        return None, 0
+
+    user_ids = list({doc["user_id"] for doc in docs})
+    timezones = {
+        user["_id"]: user.get("timezone")
+        for user in get_user_collection().find({"_id": {"$in": user_ids}}, {"timezone": 1})
+    }
+    operations = [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": derived_fields(
+                doc["timestamp"],
+                doc.get("emotion_selected", "Bình thường"),
+                resolve_timezone(timezones.get(doc["user_id"]) or DEFAULT_TIMEZONE),
+            )},
+        )
+        for doc in docs if doc.get("timestamp")
+    ]
+    if operations:
+        journal.bulk_write(operations, ordered=False)
+    return docs[-1]["_id"], len(operations)
+
+
+async def run_backfill():
+    global _complete
+    state = await asyncio.to_thread(_acquire_lease)
+    if state is None:
+        return
+
+    token = state["lease_owner"]
+    last_id = state.get("last_id")
+    total = 0
+    print(f"Bắt đầu backfill local_date/mood_score từ {last_id}")
+    while True:
+        last_id_batch, count = await asyncio.to_thread(backfill_batch, last_id)
+        if last_id_batch is None:
+            break
+        last_id = last_id_batch
+        total += count
+        renewed = await asyncio.to_thread(
+            renew_lease, get_migration_collection(), MIGRATION_ID, token, LEASE_SECONDS,
+            {"$set": {"last_id": last_id}},
+        )
+        if not renewed:
+            print("Dừng backfill: lease đã chuyển cho worker khác")
+            return
+        # Nhường tài nguyên cho traffic thật
+        await asyncio.sleep(BACKFILL_PAUSE_SECONDS)
+
+    await asyncio.to_thread(
+        get_migration_collection().update_one,
+        {"_id": MIGRATION_ID},
+        {"$set": {"done": True, "finished_at": _now()}, "$unset": {"lease_owner": "", "lease_until": ""}},
+    )
+    _complete = True
+    print(f"Backfill local_date/mood_score hoàn tất: {total} bản ghi")
+
+
+def recompute_user_local_dates(user_id: str):
+    # User đổi múi giờ: tính lại local_date cho toàn bộ nhật ký của user đó
+    journal = get_journal_collection()
+    user = get_user_collection().find_one({"_id": user_id}, {"timezone": 1})
+    tz = resolve_timezone((user or {}).get("timezone"))
+    operations = []
+    cursor = journal.find({"user_id": user_id}, {"timestamp": 1, "emotion_selected": 1}).batch_size(BACKFILL_BATCH_SIZE)
+    for doc in cursor:
+        if not doc.get("timestamp"):
+            continue
+        operations.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": derived_fields(doc["timestamp"], doc.get("emotion_selected", "Bình thường"), tz)},
+        ))
+        if len(operations) >= BACKFILL_BATCH_SIZE:
+            journal.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        journal.bulk_write(operations, ordered=False)
@@ -0,0 +1,184 @@
+import asyncio
+import base64
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.core.config import (
+    CHAT_COMPACT_AFTER_DAYS, CHAT_COMPACTION_BATCH_SIZE, CHAT_COMPACTION_INTERVAL_SECONDS, CHAT_RAW_TTL_DAYS,
+)
+from app.core.metrics import CHAT_MESSAGES_COMPACTED
+from app.db.database import get_chat_collection, get_chat_bucket_collection, ensure_chat_ttl_index
+
+# Cursor phân trang: (timestamp, _id) của tin nhắn cuối cùng client đã nhận
+Cursor = Tuple[datetime, ObjectId]
+
+MESSAGE_FIELDS = ("_id", "user_id", "sender", "message", "timestamp")
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    raw = f"{cursor[0].isoformat()}|{cursor[1]}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        timestamp, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(message_id)
+    except Exception:
+        raise ValueError("cursor không hợp lệ")
+
+
+def _sort_key(message: dict) -> Cursor:
+    return message["timestamp"], message["_id"]
+
+
+def _day_key(timestamp: datetime) -> str:
+    return timestamp.date().isoformat()
+
+
+def get_history_page(user_id: str, limit: int, before: Optional[Cursor] = None) -> Tuple[List[dict], Optional[Cursor]]:
+    """Trả về tối đa `limit` tin nhắn mới nhất trước `before`, xếp từ mới đến cũ.
+
+    Tin nhắn gần đây nằm trong chat_messages, tin nhắn cũ đã được gộp vào chat_buckets;
+    bucket chỉ được đọc khi phần tin nhắn gốc không đủ `limit`.
+    """
+    query: dict = {"user_id": user_id}
+    if before is not None:
+        query["$or"] = [
+            {"timestamp": {"$lt": before[0]}},
+            {"timestamp": before[0], "_id": {"$lt": before[1]}},
+        ]
+    messages = list(
+        get_chat_collection().find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit)
+    )
+
+    if len(messages) < limit:
+        seen = {message["_id"] for message in messages}
+        bucket_query: dict = {"user_id": user_id}
+        if before is not None:
+            bucket_query["day"] = {"$lte": _day_key(before[0])}
+        cursor = get_chat_bucket_collection().find(bucket_query).sort("day", -1)
+        try:
+            for bucket in cursor:
+                for message in sorted(bucket.get("messages", []), key=_sort_key, reverse=True):
+                    # Tin nhắn đang gộp dở có thể còn ở cả hai nơi
+                    if message["_id"] in seen or (before is not None and _sort_key(message) >= before):
+                        continue
+                    seen.add(message["_id"])
+                    messages.append(dict(message, user_id=user_id))
+                    if len(messages) >= limit:
+                        break
+                if len(messages) >= limit:
+                    break
+        finally:
+            cursor.close()
+
+    next_cursor = _sort_key(messages[-1]) if len(messages) == limit else None
+    return messages, next_cursor
+
+
+def get_recent_messages(user_id: str, limit: int) -> List[dict]:
+    # Dùng làm ngữ cảnh cho chatbot: xếp từ cũ đến mới
+    messages, _ = get_history_page(user_id, limit)
+    return messages[::-1]
+
+
+def iter_archived_messages(user_id: str, resume_after: Optional[ObjectId] = None):
+    # Cho export: đi qua các bucket theo ngày, trong ngày theo _id
+    buckets = get_chat_bucket_collection()
+    query: dict = {"user_id": user_id}
+    resume_day = None
+    if resume_after is not None:
+        resume_bucket = buckets.find_one({"user_id": user_id, "messages._id": resume_after}, {"day": 1})
+        if resume_bucket is not None:
+            resume_day = resume_bucket["day"]
+            query["day"] = {"$gte": resume_day}
+
+    cursor = buckets.find(query).sort("day", 1)
+    try:
+        for bucket in cursor:
+            for message in sorted(bucket.get("messages", []), key=lambda m: m["_id"]):
+                if bucket["day"] == resume_day and message["_id"] <= resume_after:
+                    continue
+                yield dict(message, user_id=user_id)
+    finally:
+        cursor.close()
+
+
+def delete_user_history(user_id: str) -> int:
+    archived = next(get_chat_bucket_collection().aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": None, "count": {"$sum": {"$size": "$messages"}}}},
+    ]), {"count": 0})["count"]
+    get_chat_bucket_collection().delete_many({"user_id": user_id})
+    return get_chat_collection().delete_many({"user_id": user_id}).deleted_count + archived
+
+
+def compact_batch(cutoff: datetime) -> int:
+    chat = get_chat_collection()
+    docs = list(
+        chat.find({"timestamp": {"$lt": cutoff}}, {field: 1 for field in MESSAGE_FIELDS})
+        .sort("timestamp", 1)
+        .limit(CHAT_COMPACTION_BATCH_SIZE)
+    )
+    if not docs:
+        return 0
+
+    buckets: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+    for doc in docs:
+        buckets[(doc["user_id"], _day_key(doc["timestamp"]))].append({
+            "_id": doc["_id"],
+            "sender": doc.get("sender"),
+            "message": doc.get("message"),
+            "timestamp": doc["timestamp"],
+        })
+
+    now = datetime.now(timezone.utc)
+    # $addToSet: chạy lại sau khi dừng giữa chừng không tạo bản sao trong bucket
+    get_chat_bucket_collection().bulk_write([
+        UpdateOne(
+            {"_id": f"{user_id}:{day}"},
+            {
+                "$setOnInsert": {"user_id": user_id, "day": day},
+                "$addToSet": {"messages": {"$each": messages}},
+                "$set": {"updated_at": now},
+            },
+            upsert=True,
+        )
+        for (user_id, day), messages in buckets.items()
+    ], ordered=False)
+    chat.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+    CHAT_MESSAGES_COMPACTED.inc(len(docs))
+    return len(docs)
+
+
+def compact_old_messages() -> int:
+    cutoff = datetime.now() - timedelta(days=CHAT_COMPACT_AFTER_DAYS)
+    total = 0
+    while True:
+        count = compact_batch(cutoff)
+        total += count
+        if count < CHAT_COMPACTION_BATCH_SIZE:
+            return total
+
+
+async def run_chat_compactor():
+    ttl_ready = CHAT_RAW_TTL_DAYS <= 0
+    while True:
+        try:
+            compacted = await asyncio.to_thread(compact_old_messages)
+            if compacted:
+                print(f"Đã gộp {compacted} tin nhắn chat cũ vào chat_buckets")
+            if not ttl_ready:
+                # compact_old_messages chỉ trả về khi đã hết tin nhắn quá hạn gộp: lúc này TTL
+                # không còn xóa tin nhắn nào chưa được lưu vào chat_buckets
+                await asyncio.to_thread(ensure_chat_ttl_index)
+                ttl_ready = True
+        except Exception as e:
+            print(f"Lỗi gộp tin nhắn chat: {e}")
+        await asyncio.sleep(CHAT_COMPACTION_INTERVAL_SECONDS)
@@ -0,0 +1,153 @@
+import base64
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+
+from app.db.database import get_journal_collection, get_chat_collection
+from app.services.chat_history_service import iter_archived_messages
+
+EXPORT_BATCH_SIZE = 500
+# Số bản ghi gom lại trước khi đẩy một chunk ra response
+RECORDS_PER_CHUNK = 200
+
+# chat_archive: tin nhắn cũ đã được gộp vào chat_buckets, xuất trước tin nhắn gần đây
+SECTIONS = ("journal", "chat_archive", "chat")
+
+CSV_COLUMNS = [
+    "type", "id", "timestamp", "emotion_selected", "content", "image_urls",
+    "sentiment_score", "detected_emotion", "advice", "is_match", "suggested_emotion",
+    "sender", "message", "resume_token",
+]
+
+
+def encode_resume_token(section: str, last_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(f"{section}:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_resume_token(token: str) -> Tuple[str, ObjectId]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        section, last_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+    except Exception:
+        raise ValueError("resume_token không hợp lệ")
+    if section not in SECTIONS or not ObjectId.is_valid(last_id):
+        raise ValueError("resume_token không hợp lệ")
+    return section, ObjectId(last_id)
+
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _journal_record(doc: dict) -> dict:
+    return {
+        "type": "journal",
+        "id": str(doc["_id"]),
+        "timestamp": _iso(doc.get("timestamp")),
+        "emotion_selected": doc.get("emotion_selected"),
+        "content": doc.get("content"),
+        "image_urls": doc.get("image_urls") or [],
+        "analysis": doc.get("analysis"),
+    }
+
+
+def _chat_record(doc: dict) -> dict:
+    return {
+        "type": "chat",
+        "id": str(doc["_id"]),
+        "timestamp": _iso(doc.get("timestamp")),
+        "sender": doc.get("sender"),
+        "message": doc.get("message"),
+    }
+
+
+def iter_export_records(user_id: str, include_chat: bool, resume_token: Optional[str] = None) -> Iterator[dict]:
+    sections: List[str] = list(SECTIONS) if include_chat else ["journal"]
+    resume_section, resume_after = decode_resume_token(resume_token) if resume_token else (None, None)
+    if resume_section is not None:
+        if resume_section not in sections:
+            return
+        sections = sections[sections.index(resume_section):]
+
+    sources = {
+        "journal": (get_journal_collection, _journal_record),
+        "chat": (get_chat_collection, _chat_record),
+    }
+    for section in sections:
+        if section == "chat_archive":
+            after = resume_after if section == resume_section else None
+            for doc in iter_archived_messages(user_id, after):
+                record = _chat_record(doc)
+                record["resume_token"] = encode_resume_token(section, doc["_id"])
+                yield record
+            continue
+
+        get_collection, to_record = sources[section]
+        query = {"user_id": user_id}
+        if section == resume_section:
+            query["_id"] = {"$gt": resume_after}
+
+        # Sắp theo _id để resume_token luôn trỏ đúng vị trí, batch_size giữ bộ nhớ không đổi
+        cursor = get_collection().find(query).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+        try:
+            for doc in cursor:
+                record = to_record(doc)
+                record["resume_token"] = encode_resume_token(section, doc["_id"])
+                yield record
+        finally:
+            cursor.close()
+
+
+def _ndjson_lines(records: Iterator[dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+def _csv_lines(records: Iterator[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+    for record in records:
+        buffer.seek(0)
+        buffer.truncate()
+        analysis = record.get("analysis") or {}
+        row = dict(record, **{k: analysis.get(k) for k in (
+            "sentiment_score", "detected_emotion", "advice", "is_match", "suggested_emotion"
+        )})
+        row["image_urls"] = " ".join(record.get("image_urls") or [])
+        writer.writerow(["" if row.get(col) is None else row.get(col) for col in CSV_COLUMNS])
+        yield buffer.getvalue()
+
+
+def stream_export(
+    user_id: str,
+    export_format: str,
+    include_chat: bool,
+    resume_token: Optional[str] = None,
+    gzip: bool = False,
+) -> Iterator[bytes]:
+    records = iter_export_records(user_id, include_chat, resume_token)
+    lines = _csv_lines(records) if export_format == "csv" else _ndjson_lines(records)
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    chunk: List[str] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= RECORDS_PER_CHUNK:
+            data = "".join(chunk).encode("utf-8")
+            chunk.clear()
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = "".join(chunk).encode("utf-8")
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
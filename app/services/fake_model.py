@@ -0,0 +1,64 @@
+import asyncio
+import json
+import random
+
+from google.api_core import exceptions as google_exceptions
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = 0
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_token_count: int = 0):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_token_count)
+
+
+def estimate_tokens(*parts) -> int:
+    # Ước lượng thô ~4 ký tự / token, đủ để thấy thay đổi trên ai_prompt_tokens
+    return sum(len(str(part)) for part in parts) // 4
+
+
+class FakeChatSession:
+    def __init__(self, model: "FakeGenerativeModel", history: list):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, content, **kwargs) -> FakeResponse:
+        return await self.model._respond(self.model.chat_reply, estimate_tokens(self.history, content))
+
+
+class FakeGenerativeModel:
+    # Thay thế genai.GenerativeModel: độ trễ và tỉ lệ lỗi cấu hình được
+    def __init__(self, latency: float = 0.2, failure_rate: float = 0.0, json_mode: bool = False):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.json_mode = json_mode
+        self.chat_reply = "Mình luôn ở đây lắng nghe bạn."
+        self.analysis_reply = {
+            "sentiment_score": 0.0,
+            "detected_emotion": "Bình thường",
+            "is_match": True,
+            "suggested_emotion": "Bình thường",
+            "advice": "Hãy dành chút thời gian nghỉ ngơi nhé.",
+        }
+        self.calls = 0
+
+    async def _respond(self, payload, prompt_tokens: int = 0) -> FakeResponse:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise google_exceptions.ServiceUnavailable("Fake model unavailable")
+        text = json.dumps(payload, ensure_ascii=False) if isinstance(payload, dict) else payload
+        return FakeResponse(text, prompt_tokens)
+
+    async def generate_content_async(self, contents, **kwargs) -> FakeResponse:
+        return await self._respond(
+            self.analysis_reply if self.json_mode else self.chat_reply, estimate_tokens(contents)
+        )
+
+    def start_chat(self, history: list = None) -> FakeChatSession:
+        return FakeChatSession(self, history)
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from cachetools import TTLCache
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.core.config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_CACHE_SIZE
+from app.core.metrics import IDEMPOTENT_REPLAYS
+from app.db.database import get_idempotency_collection
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL_SECONDS = 0.2
+# Worker giữ key gia hạn lease_until mỗi LEASE_RENEW_SECONDS trong lúc handler chạy (kể cả khi
+# handler chờ AI lâu hơn nhiều), quá lease mà không gia hạn thì coi như worker đó đã chết
+PENDING_LEASE_SECONDS = 30.0
+LEASE_RENEW_SECONDS = PENDING_LEASE_SECONDS / 3
+# Handler đã ghi xong mà không lưu được response thì request thử lại sẽ ghi trùng: cố lưu vài lần
+MARK_DONE_ATTEMPTS = 4
+
+# Cache phía trước Mongo cho các response đã hoàn tất
+_completed: TTLCache = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL_SECONDS)
+# Request đang chạy trong worker này, request trùng key chỉ cần chờ future
+_in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+
+def request_fingerprint(payload: dict) -> str:
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _check_fingerprint(stored: Optional[str], fingerprint: str):
+    if stored and stored != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key đã được dùng cho một request có nội dung khác",
+        )
+
+
+def _lease_deadline() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=PENDING_LEASE_SECONDS)
+
+
+def _is_stale(doc: dict) -> bool:
+    # Bản ghi cũ chưa có lease_until: tính lease từ created_at
+    lease_until = doc.get("lease_until")
+    if lease_until is None and doc.get("created_at") is not None:
+        lease_until = doc["created_at"] + timedelta(seconds=PENDING_LEASE_SECONDS)
+    if lease_until is None:
+        return True
+    if lease_until.tzinfo is None:
+        lease_until = lease_until.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) > lease_until
+
+
+async def _wait_for_other_worker(doc_id: str, fingerprint: str) -> Optional[dict]:
+    # Một worker khác đang xử lý cùng key: chờ kết quả được ghi vào Mongo
+    collection = get_idempotency_collection()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while loop.time() < deadline:
+        doc = collection.find_one({"_id": doc_id})
+        if doc is None:
+            # Worker kia gặp lỗi và đã nhả key
+            return None
+        _check_fingerprint(doc.get("fingerprint"), fingerprint)
+        if doc.get("status") == "done":
+            return doc["response"]
+        if _is_stale(doc):
+            # Worker giữ key đã chết giữa chừng: nhả key để request này xử lý lại.
+            # Chỉ xóa đúng lượt giữ key vừa đọc, không xóa lượt mà worker khác vừa gia hạn / giữ lại
+            collection.delete_one({
+                "_id": doc_id,
+                "status": "pending",
+                "claim": doc.get("claim"),
+                "lease_until": doc.get("lease_until"),
+            })
+            return None
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    raise HTTPException(status_code=409, detail="Request với Idempotency-Key này vẫn đang được xử lý")
+
+
+async def _renew_lease(doc_id: str, claim: str):
+    collection = get_idempotency_collection()
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SECONDS)
+        try:
+            result = collection.update_one(
+                {"_id": doc_id, "status": "pending", "claim": claim},
+                {"$set": {"lease_until": _lease_deadline()}},
+            )
+        except PyMongoError as e:
+            print(f"Lỗi gia hạn idempotency {doc_id}: {e}")
+            continue
+        if result.matched_count == 0:
+            print(f"Mất quyền giữ idempotency key {doc_id}: có thể bị ghi trùng")
+            return
+
+
+async def _claim_and_run(doc_id: str, scope: str, fingerprint: str, handler: Callable[[], Awaitable[dict]]) -> dict:
+    collection = get_idempotency_collection()
+    # Mỗi lượt giữ key một token: chỉ lượt đó được gia hạn, nhả key hoặc lưu response
+    claim = uuid.uuid4().hex
+    while True:
+        try:
+            collection.insert_one({
+                "_id": doc_id,
+                "status": "pending",
+                "fingerprint": fingerprint,
+                "claim": claim,
+                "created_at": datetime.now(timezone.utc),
+                "lease_until": _lease_deadline(),
+            })
+        except DuplicateKeyError:
+            stored = await _wait_for_other_worker(doc_id, fingerprint)
+            if stored is None:
+                continue
+            IDEMPOTENT_REPLAYS.inc(scope=scope, source="db")
+            return stored
+        break
+
+    renewer = asyncio.create_task(_renew_lease(doc_id, claim))
+    try:
+        response = await handler()
+    except BaseException:
+        renewer.cancel()
+        # Nhả key để client có thể thử lại
+        collection.delete_one({"_id": doc_id, "status": "pending", "claim": claim})
+        raise
+    renewer.cancel()
+    await _mark_done(doc_id, claim, response)
+    return response
+
+
+async def _mark_done(doc_id: str, claim: str, response: dict):
+    collection = get_idempotency_collection()
+    for attempt in range(MARK_DONE_ATTEMPTS):
+        try:
+            result = collection.update_one(
+                {"_id": doc_id, "claim": claim},
+                {"$set": {"status": "done", "response": response}, "$unset": {"lease_until": ""}},
+            )
+            if result.matched_count == 0:
+                print(f"Không lưu response idempotency {doc_id}: key đã thuộc về lượt khác")
+            return
+        except PyMongoError as e:
+            print(f"Lỗi lưu response idempotency {doc_id} (lần {attempt + 1}): {e}")
+            if attempt + 1 < MARK_DONE_ATTEMPTS:
+                await asyncio.sleep(POLL_INTERVAL_SECONDS * 2 ** attempt)
+    # Vẫn trả response cho client: side effect đã xảy ra, worker này còn replay được từ _completed
+
+
+async def run_idempotent(
+    user_id: str,
+    scope: str,
+    key: Optional[str],
+    payload: dict,
+    handler: Callable[[], Awaitable[dict]],
+) -> dict:
+    # handler trả về dict lưu được vào BSON (ObjectId, datetime giữ nguyên kiểu)
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key quá dài")
+
+    doc_id = f"{user_id}:{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+
+    cached = _completed.get(doc_id)
+    if cached is not None:
+        _check_fingerprint(cached[0], fingerprint)
+        IDEMPOTENT_REPLAYS.inc(scope=scope, source="cache")
+        return cached[1]
+
+    running = _in_flight.get(doc_id)
+    if running is not None:
+        stored_fingerprint, future = running
+        _check_fingerprint(stored_fingerprint, fingerprint)
+        response = await asyncio.shield(future)
+        IDEMPOTENT_REPLAYS.inc(scope=scope, source="in_flight")
+        return response
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[doc_id] = (fingerprint, future)
+    try:
+        response = await _claim_and_run(doc_id, scope, fingerprint, handler)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        # Không có ai chờ thì cũng không log "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        _in_flight.pop(doc_id, None)
+
+    _completed[doc_id] = (fingerprint, response)
+    future.set_result(response)
+    return response
@@ -0,0 +1,60 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+DUPLICATE_KEY_ERROR = 11000
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def acquire_lease(
+    collection: Collection,
+    job_id: str,
+    lease_seconds: float,
+    on_insert: dict,
+    extra_filter: Optional[dict] = None,
+) -> Optional[dict]:
+    """Giữ lease của một job nền lưu trong document `job_id`.
+
+    Mỗi lần lấy lease có token riêng (lưu ở lease_owner), kể cả trong cùng một worker:
+    lượt chạy thứ hai của chính worker đó cũng phải chờ lease hết hạn hoặc được nhả.
+    Trả về document sau khi lấy lease, hoặc None nếu lease đang bị giữ.
+    """
+    now = _now()
+    collection.update_one({"_id": job_id}, {"$setOnInsert": on_insert}, upsert=True)
+    token = f"{WORKER_ID}:{uuid.uuid4().hex}"
+    return collection.find_one_and_update(
+        {
+            "_id": job_id,
+            **(extra_filter or {}),
+            "$or": [
+                {"lease_until": {"$exists": False}},
+                {"lease_until": {"$lt": now}},
+            ],
+        },
+        {"$set": {"lease_owner": token, "lease_until": now + timedelta(seconds=lease_seconds)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renew_lease(collection: Collection, job_id: str, token: str, lease_seconds: float, update: Optional[dict] = None) -> bool:
+    # Ghi tiến độ kèm gia hạn lease; False nếu lease đã hết hạn và bị lượt chạy khác lấy mất
+    update = dict(update or {})
+    update["$set"] = dict(update.get("$set", {}), lease_until=_now() + timedelta(seconds=lease_seconds))
+    result = collection.update_one({"_id": job_id, "lease_owner": token}, update)
+    return result.matched_count == 1
+
+
+def release_lease(collection: Collection, job_id: str, token: str, update: Optional[dict] = None):
+    update = dict(update or {})
+    update["$unset"] = dict(update.get("$unset", {}), lease_owner="", lease_until="")
+    collection.update_one({"_id": job_id, "lease_owner": token}, update)
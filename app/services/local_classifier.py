@@ -0,0 +1,185 @@
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from textblob import TextBlob
+
+from app.models.journal import AIAnalysis
+from app.core.emotions import EMOTION_SCORES, DEFAULT_SCORE
+
+# Từ điển cảm xúc tiếng Việt: điểm trong khoảng [-1, 1], cụm nhiều âm tiết được khớp trước
+VI_LEXICON = {
+    # Tích cực mạnh
+    "hạnh phúc": 0.9, "tuyệt vời": 0.9, "tuyệt quá": 0.9, "sung sướng": 0.9, "hạnh phúc quá": 1.0,
+    "phấn khích": 0.8, "hào hứng": 0.7, "phấn khởi": 0.8, "mãn nguyện": 0.8, "hân hoan": 0.8,
+    "yêu đời": 0.9, "tự hào": 0.7, "biết ơn": 0.7, "thành công": 0.7, "rạng rỡ": 0.7,
+    "tuyệt": 0.8, "xuất sắc": 0.8, "hoàn hảo": 0.8,
+    # Tích cực vừa
+    "vui": 0.6, "vui vẻ": 0.7, "vui mừng": 0.7, "mừng": 0.6, "thích": 0.5, "yêu": 0.6,
+    "thương": 0.5, "tốt": 0.5, "ổn": 0.3, "khá ổn": 0.4, "bình yên": 0.6, "bình an": 0.6,
+    "thư giãn": 0.5, "thoải mái": 0.6, "dễ chịu": 0.5, "nhẹ nhõm": 0.6, "thanh thản": 0.6,
+    "hài lòng": 0.6, "may mắn": 0.6, "ấm áp": 0.5, "an tâm": 0.5, "yên tâm": 0.5,
+    "tự tin": 0.5, "năng động": 0.4, "khỏe": 0.4, "khoẻ": 0.4, "hy vọng": 0.4, "hi vọng": 0.4,
+    "đáng yêu": 0.5, "cười": 0.4, "vui tươi": 0.6, "ngon": 0.3, "đẹp": 0.3, "thú vị": 0.5,
+    "được khen": 0.6, "thăng chức": 0.7, "đỗ": 0.6, "đậu": 0.5, "hoàn thành": 0.4,
+    # Trung tính / hơi tiêu cực
+    "bình thường": 0.0, "mệt": -0.4, "mệt mỏi": -0.5, "chán": -0.5, "nhàm chán": -0.4,
+    "uể oải": -0.4, "lo": -0.4, "lo lắng": -0.6, "bồn chồn": -0.5, "áp lực": -0.5,
+    "căng thẳng": -0.6, "stress": -0.6, "khó chịu": -0.5, "bực": -0.5, "bực mình": -0.6,
+    "bực bội": -0.6, "cáu": -0.5, "khó khăn": -0.4, "vất vả": -0.4, "thất vọng": -0.6,
+    "buồn": -0.6, "buồn bã": -0.7, "buồn chán": -0.6, "cô đơn": -0.6, "lạc lõng": -0.6,
+    "nhớ nhà": -0.3, "tiếc": -0.4, "hối hận": -0.6, "xấu hổ": -0.5, "ngại": -0.3,
+    "sợ": -0.5, "sợ hãi": -0.7, "hoang mang": -0.6, "bế tắc": -0.7, "tủi thân": -0.6,
+    "ốm": -0.4, "bệnh": -0.4, "đau": -0.5, "mất ngủ": -0.5, "khóc": -0.6, "trượt": -0.5,
+    "thất bại": -0.6, "cãi nhau": -0.6, "chia tay": -0.7, "bị mắng": -0.6, "tệ": -0.6,
+    "kém": -0.4, "xui": -0.5, "xui xẻo": -0.6, "giận": -0.6, "tức": -0.6, "tức giận": -0.7,
+    "ghét": -0.6, "phiền": -0.4, "phiền muộn": -0.6,
+    # Tiêu cực mạnh
+    "tuyệt vọng": -0.95, "đau khổ": -0.9, "đau đớn": -0.8, "suy sụp": -0.9, "trầm cảm": -0.9,
+    "kiệt sức": -0.8, "hoảng loạn": -0.9, "ghê tởm": -0.8, "căm ghét": -0.8, "tồi tệ": -0.8,
+    "khủng khiếp": -0.8, "kinh khủng": -0.7, "muốn chết": -1.0, "chán sống": -1.0,
+    "tự tử": -1.0, "vô vọng": -0.9, "mất hết": -0.7, "đổ vỡ": -0.8, "tan vỡ": -0.8,
+}
+
+# Đảo chiều từ cảm xúc đứng ngay sau (trong NEGATION_WINDOW âm tiết)
+NEGATIONS = {"không", "chẳng", "chả", "chưa", "đâu có", "không hề", "chẳng hề", "hết", "bớt", "đỡ"}
+NEGATION_WINDOW = 3
+NEGATION_FACTOR = -0.7
+
+# Từ nhấn mạnh đứng trước hoặc sau từ cảm xúc
+INTENSIFIERS = {
+    "rất": 1.4, "cực": 1.5, "cực kỳ": 1.6, "cực kì": 1.6, "vô cùng": 1.6, "siêu": 1.5,
+    "quá": 1.4, "lắm": 1.3, "thật sự": 1.3, "thực sự": 1.3, "hết sức": 1.5, "khá": 1.1,
+    "hơi": 0.6, "một chút": 0.6, "chút": 0.7, "hơi hơi": 0.5, "tạm": 0.6,
+}
+POST_INTENSIFIERS = {"quá", "lắm", "cực", "vô cùng", "thật", "ghê"}
+
+# Câu có ý tương phản: cảm xúc lẫn lộn, nên để Gemini đọc
+CONTRASTS = {"nhưng", "tuy", "tuy nhiên", "mặc dù", "dù", "song", "thế nhưng"}
+
+# Từ ở mức này (tuyệt vọng, muốn chết...) luôn chuyển cho Gemini để có lời khuyên phù hợp
+SEVERE_SCORE = -0.9
+
+MAX_NGRAM = 3
+# Chuẩn hóa tổng điểm về [-1, 1] như VADER
+NORMALIZATION_ALPHA = 1.5
+LONG_TEXT_TOKENS = 80
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class LocalResult:
+    analysis: AIAnalysis
+    confidence: float
+    hits: int
+
+
+def _tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def _match(tokens: List[str], start: int, vocabulary) -> Tuple[Optional[str], int]:
+    # Khớp cụm dài nhất bắt đầu tại start
+    for size in range(MAX_NGRAM, 0, -1):
+        phrase = " ".join(tokens[start:start + size])
+        if len(phrase.split(" ")) == size and phrase in vocabulary:
+            return phrase, size
+    return None, 0
+
+
+def score_vietnamese(tokens: List[str]) -> Tuple[List[float], bool]:
+    scores: List[float] = []
+    negate_until = -1
+    multiplier = 1.0
+    has_contrast = False
+    i = 0
+    while i < len(tokens):
+        phrase, size = _match(tokens, i, CONTRASTS)
+        if phrase:
+            has_contrast = True
+
+        # Một lần khớp dài nhất trên cả ba từ điển: "hết sức" là từ nhấn mạnh chứ không phải "hết" (phủ định)
+        vocabulary, phrase, size = max(
+            ((vocabulary,) + _match(tokens, i, vocabulary) for vocabulary in (VI_LEXICON, NEGATIONS, INTENSIFIERS)),
+            key=lambda candidate: candidate[2],
+        )
+        if vocabulary is VI_LEXICON and phrase:
+            value = VI_LEXICON[phrase] * multiplier
+            if i <= negate_until:
+                value *= NEGATION_FACTOR
+            following, following_size = _match(tokens, i + size, POST_INTENSIFIERS)
+            if following:
+                value *= INTENSIFIERS.get(following, 1.3)
+            scores.append(max(-1.5, min(1.5, value)))
+            multiplier = 1.0
+            i += size + following_size
+            continue
+
+        if vocabulary is NEGATIONS and phrase:
+            negate_until = i + size + NEGATION_WINDOW - 1
+            i += size
+            continue
+
+        if vocabulary is INTENSIFIERS and phrase:
+            multiplier = INTENSIFIERS[phrase]
+            i += size
+            continue
+
+        multiplier = 1.0
+        i += 1
+    return scores, has_contrast
+
+
+def emotion_for_score(score: float) -> str:
+    if score >= 0.6:
+        return "Rất tốt"
+    if score >= 0.2:
+        return "Tốt"
+    if score > -0.2:
+        return "Bình thường"
+    if score > -0.6:
+        return "Tệ"
+    return "Rất tệ"
+
+
+def classify(content: str, selected_emotion: str) -> LocalResult:
+    tokens = _tokenize(content)
+    scores, has_contrast = score_vietnamese(tokens)
+
+    if scores:
+        total = sum(scores)
+        positive = sum(value for value in scores if value > 0)
+        negative = -sum(value for value in scores if value < 0)
+        score = total / math.sqrt(total * total + NORMALIZATION_ALPHA)
+        # Các từ cùng chiều và đủ mạnh -> tự tin; trái chiều nhau -> để Gemini đọc
+        consistency = abs(positive - negative) / (positive + negative) if positive + negative else 0.0
+        strength = min(1.0, (positive + negative) / 1.2)
+        confidence = consistency * strength
+        if has_contrast:
+            confidence *= 0.6
+        if len(tokens) > LONG_TEXT_TOKENS:
+            confidence *= LONG_TEXT_TOKENS / len(tokens)
+        if min(scores) <= SEVERE_SCORE:
+            confidence = 0.0
+        hits = len(scores)
+    else:
+        # Không có từ tiếng Việt nào trong từ điển: thử bộ phân tích tiếng Anh của TextBlob
+        sentiment = TextBlob(content).sentiment
+        score = float(sentiment.polarity)
+        confidence = float(sentiment.subjectivity) * min(1.0, abs(score) / 0.3) if score else 0.0
+        hits = 1 if score else 0
+
+    detected = emotion_for_score(score)
+    # Lệch không quá một bậc trên thang 5 mức coi như khớp
+    is_match = abs(EMOTION_SCORES.get(detected, DEFAULT_SCORE) - EMOTION_SCORES.get(selected_emotion, DEFAULT_SCORE)) <= 1
+    analysis = AIAnalysis(
+        sentiment_score=round(score, 3),
+        detected_emotion=detected,
+        advice="",
+        is_match=is_match,
+        suggested_emotion=selected_emotion if is_match and selected_emotion in EMOTION_SCORES else detected,
+    )
+    return LocalResult(analysis=analysis, confidence=round(confidence, 3), hits=hits)
@@ -0,0 +1,54 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.core.config import DEFAULT_TIMEZONE
+from app.core.emotions import EMOTION_SCORES, DEFAULT_SCORE
+from app.services.profile_service import get_profile
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def resolve_timezone(name: Optional[str]) -> ZoneInfo:
+    if name and is_valid_timezone(name):
+        return ZoneInfo(name)
+    return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def get_user_timezone(user_id: str) -> ZoneInfo:
+    # Múi giờ đọc rất nhiều lần khi ghi nhật ký: lấy từ cache hồ sơ thay vì query riêng
+    return resolve_timezone((get_profile(user_id) or {}).get("timezone"))
+
+
+def mood_score(emotion: Optional[str]) -> int:
+    return EMOTION_SCORES.get(emotion, DEFAULT_SCORE)
+
+
+def local_date_of(timestamp: datetime, tz: ZoneInfo) -> date:
+    # timestamp lưu trong Mongo là UTC (naive)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(tz).date()
+
+
+def local_date_key(timestamp: datetime, tz: ZoneInfo) -> str:
+    # Lưu dạng "YYYY-MM-DD" để so sánh chuỗi đúng thứ tự ngày và dùng được index
+    return local_date_of(timestamp, tz).isoformat()
+
+
+def derived_fields(timestamp: datetime, emotion: str, tz: ZoneInfo) -> dict:
+    return {
+        "local_date": local_date_key(timestamp, tz),
+        "mood_score": mood_score(emotion),
+    }
+
+
+def utc_offset_minutes(tz: ZoneInfo, at: Optional[datetime] = None) -> int:
+    at = at or datetime.now(timezone.utc)
+    offset = at.astimezone(tz).utcoffset() or timedelta(0)
+    return int(offset.total_seconds() // 60)
@@ -0,0 +1,77 @@
+import uuid
+from typing import Optional
+
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+
+from app.core.config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS
+from app.db.database import get_user_collection
+
+# Hồ sơ user đọc ở mọi request (auth, múi giờ, persona chat) nhưng rất ít khi đổi.
+# Mỗi lần ghi tăng "version": bản mới nhất thấy được (kể cả từ worker khác qua upsert
+# ở auth) luôn thắng bản đang nằm trong cache. Mỗi lần document được tạo (kể cả tạo lại
+# sau khi link-google xóa user cũ) có "generation" mới: khác generation thì version cũ
+# trong cache không còn ý nghĩa và bị thay luôn
+_profile_cache: TTLCache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL_SECONDS)
+
+NEW_USER_FIELDS = {"name": None, "gender": None, "birth": None, "version": 0}
+
+
+def new_generation() -> str:
+    return uuid.uuid4().hex
+
+
+def new_user_fields() -> dict:
+    return dict(NEW_USER_FIELDS, generation=new_generation())
+
+
+def profile_version(profile: Optional[dict]) -> int:
+    return (profile or {}).get("version") or 0
+
+
+def remember_profile(profile: dict) -> dict:
+    cached = _profile_cache.get(profile["_id"])
+    if (
+        cached is not None
+        and cached.get("generation") == profile.get("generation")
+        and profile_version(cached) > profile_version(profile)
+    ):
+        return cached
+    _profile_cache[profile["_id"]] = profile
+    return profile
+
+
+def get_profile(user_id: str) -> Optional[dict]:
+    profile = _profile_cache.get(user_id)
+    if profile is None:
+        profile = get_user_collection().find_one({"_id": user_id})
+        if profile is not None:
+            profile = remember_profile(profile)
+    return profile
+
+
+def ensure_profile(user_id: str) -> dict:
+    # Upsert ở auth dependency: tạo user mới nếu chưa có, đồng thời làm mới cache
+    profile = get_user_collection().find_one_and_update(
+        {"_id": user_id},
+        {"$setOnInsert": dict(new_user_fields(), _id=user_id)},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return remember_profile(profile)
+
+
+def update_profile(user_id: str, fields: dict) -> Optional[dict]:
+    profile = get_user_collection().find_one_and_update(
+        {"_id": user_id},
+        {"$set": fields, "$inc": {"version": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if profile is None:
+        invalidate_profile(user_id)
+        return None
+    return remember_profile(profile)
+
+
+def invalidate_profile(user_id: str):
+    _profile_cache.pop(user_id, None)
@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+from app.core.metrics import (
+    CIRCUIT_STATE, CIRCUIT_SHORT_CIRCUITS, CIRCUIT_TRANSITIONS, AI_RETRIES, AI_HEDGES,
+)
+
+T = TypeVar("T")
+
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        CIRCUIT_STATE.set(0, name=name)
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str):
+        self._state = state
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+        if state != self.CLOSED:
+            self._half_open_calls = 0
+        if state == self.CLOSED:
+            self._failures = 0
+        CIRCUIT_STATE.set(self._STATE_VALUES[state], name=self.name)
+        CIRCUIT_TRANSITIONS.inc(name=self.name, state=state)
+        print(f"Circuit '{self.name}' -> {state}")
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return True
+        return False
+
+    def record_success(self):
+        if self._state == self.HALF_OPEN:
+            self._transition(self.CLOSED)
+        self._failures = 0
+
+    def record_failure(self):
+        if self._state == self.HALF_OPEN:
+            self._transition(self.OPEN)
+            return
+        self._failures += 1
+        if self._state == self.CLOSED and self._failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    async def call(self, make_call: Callable[[], Awaitable[T]]) -> T:
+        if not self.allow():
+            CIRCUIT_SHORT_CIRCUITS.inc(name=self.name)
+            raise CircuitOpen(f"Circuit '{self.name}' đang mở")
+        try:
+            result = await make_call()
+        except Exception as e:
+            # Lỗi không tạm thời (prompt sai, bị chặn nội dung...) nghĩa là model vẫn phản hồi
+            if is_transient(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # Bị hủy giữa chừng: trả lại lượt thử half-open
+            if self._state == self.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+            raise
+        self.record_success()
+        return result
+
+
+async def retry_with_jitter(
+    make_call: Callable[[], Awaitable[T]],
+    function: str,
+    attempts: int,
+    base_delay: float,
+    max_delay: float,
+) -> T:
+    # Full jitter: chờ ngẫu nhiên trong [0, min(max_delay, base_delay * 2^i)]
+    for attempt in range(attempts):
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                raise
+            AI_RETRIES.inc(function=function)
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+    raise RuntimeError("attempts phải >= 1")
+
+
+async def hedged(make_call: Callable[[], Awaitable[T]], function: str, delay: float) -> T:
+    # Gửi request thứ hai nếu request đầu chưa xong sau `delay` giây, lấy kết quả về trước
+    primary = asyncio.ensure_future(make_call())
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if done:
+        return primary.result()
+
+    backup = asyncio.ensure_future(make_call())
+    pending = {primary, backup}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    AI_HEDGES.inc(function=function, winner="primary" if task is primary else "backup")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
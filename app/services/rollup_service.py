@@ -0,0 +1,305 @@
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core.config import (
+    ROLLUP_INTERVAL_SECONDS, ROLLUP_BATCH_SIZE, ROLLUP_MAX_BATCHES_PER_RUN, ROLLUP_SETTLE_SECONDS,
+    ROLLUP_PENDING_MAX_WAIT_SECONDS, ROLLUP_MAX_DEFERRED,
+)
+from app.core.metrics import ROLLUP_DOCUMENTS, ROLLUP_LAG_SECONDS
+from app.db.database import (
+    get_journal_collection, get_chat_collection, get_job_collection,
+    get_rollup_collection, get_rollup_marker_collection,
+)
+from app.services.ai_service import analysis_source, CHAT_FALLBACK_MESSAGES
+from app.services.mood_service import mood_score
+from app.services.job_lease import DUPLICATE_KEY_ERROR, acquire_lease, renew_lease, release_lease
+
+JOB_ID = "daily_rollup"
+LEASE_SECONDS = 120
+# Mỗi ngày nhớ id của các batch gần nhất đã cộng vào: chạy lại batch dở dang không cộng trùng
+APPLIED_BATCH_HISTORY = 50
+UNANALYZED_STATUSES = ("pending", "analyzing")
+
+# Chỉ đọc các trường cần gộp, không đọc nội dung nhật ký
+SOURCES = {
+    "journal": {
+        "collection": get_journal_collection,
+        "projection": {
+            "user_id": 1, "emotion_selected": 1, "mood_score": 1,
+            "analysis": 1, "analysis_source": 1, "analysis_status": 1,
+        },
+    },
+    "chat": {
+        "collection": get_chat_collection,
+        "projection": {"sender": 1, "message": 1},
+    },
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _day_key(doc_id: ObjectId) -> str:
+    # Gộp theo ngày ghi (UTC) lấy từ _id, không theo timestamp do client gửi lên
+    return doc_id.generation_time.date().isoformat()
+
+
+def _acquire_lease() -> Optional[dict]:
+    # Scheduler của mọi worker và POST /admin/rollups/run: mỗi lúc chỉ một lượt được gộp
+    return acquire_lease(get_job_collection(), JOB_ID, LEASE_SECONDS, on_insert={"watermarks": {}})
+
+
+def _release_lease(token: str):
+    release_lease(get_job_collection(), JOB_ID, token, {"$set": {"last_run_at": _now()}})
+
+
+def _save_progress(token: str, update: dict) -> bool:
+    # False nếu lease đã bị lượt chạy khác lấy mất (chạy quá LEASE_SECONDS)
+    return renew_lease(get_job_collection(), JOB_ID, token, LEASE_SECONDS, update)
+
+
+def _field_key(value: str) -> str:
+    # Tên cảm xúc do client gửi lên, không được chứa ký tự đặc biệt của field path
+    return value.replace(".", "_").lstrip("$") or "Bình thường"
+
+
+def _fold_journal(docs: List[dict]) -> tuple:
+    increments: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    active_users = set()
+    for doc in docs:
+        day = _day_key(doc["_id"])
+        inc = increments[day]
+        emotion = doc.get("emotion_selected") or "Bình thường"
+        source = doc.get("analysis_source") or analysis_source(doc.get("analysis"))
+        inc["journal_entries"] += 1
+        inc[f"mood_counts.{_field_key(emotion)}"] += 1
+        inc["mood_score_sum"] += doc.get("mood_score") or mood_score(emotion)
+        inc["mood_score_count"] += 1
+        inc[f"analysis_sources.{source}"] += 1
+        active_users.add((day, doc["user_id"]))
+    return increments, active_users
+
+
+def _fold_chat(docs: List[dict]) -> tuple:
+    increments: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for doc in docs:
+        inc = increments[_day_key(doc["_id"])]
+        if doc.get("sender") == "user":
+            inc["chat_user_messages"] += 1
+        else:
+            inc["chat_bot_replies"] += 1
+            if doc.get("message") in CHAT_FALLBACK_MESSAGES:
+                inc["chat_fallbacks"] += 1
+    return increments, set()
+
+
+def _count_new_active_users(active_users: set, batch_id: str) -> Dict[str, int]:
+    # Marker (ngày, user) chỉ được tạo một lần và ghi batch tạo ra nó -> số marker của batch
+    # chính là số DAU tăng thêm, kể cả khi batch được chạy lại sau khi dừng giữa chừng
+    if not active_users:
+        return {}
+    now = _now()
+    marker_ids = [f"{day}:{user_id}" for day, user_id in active_users]
+    operations = [
+        UpdateOne(
+            {"_id": f"{day}:{user_id}"},
+            {"$setOnInsert": {"day": day, "user_id": user_id, "batch": batch_id, "created_at": now}},
+            upsert=True,
+        )
+        for day, user_id in active_users
+    ]
+    markers = get_rollup_marker_collection()
+    try:
+        markers.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Hai upsert trùng _id chạy song song: bản ghi còn lại đã được tính
+        if any(err["code"] != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+            raise
+
+    new_users: Dict[str, int] = defaultdict(int)
+    for marker in markers.find({"_id": {"$in": marker_ids}, "batch": batch_id}, {"day": 1}):
+        new_users[marker["day"]] += 1
+    return new_users
+
+
+def _apply_increments(increments: Dict[str, Dict[str, int]], new_users: Dict[str, int], batch_id: str):
+    now = _now()
+    days = set(increments) | set(new_users)
+    operations = []
+    for day in sorted(days):
+        inc = {field: value for field, value in increments.get(day, {}).items() if value}
+        if new_users.get(day):
+            inc["active_users"] = new_users[day]
+        if not inc:
+            continue
+        # Ngày đã có batch_id thì filter không khớp, upsert va _id -> lỗi trùng khóa, bỏ qua
+        operations.append(UpdateOne(
+            {"_id": day, "applied_batches": {"$ne": batch_id}},
+            {
+                "$inc": inc,
+                "$set": {"updated_at": now},
+                "$push": {"applied_batches": {"$each": [batch_id], "$slice": -APPLIED_BATCH_HISTORY}},
+            },
+            upsert=True,
+        ))
+    if not operations:
+        return
+    try:
+        get_rollup_collection().bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if any(err["code"] != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def _apply_batch(source: str, batch_id: str, docs: List[dict]) -> int:
+    fold = _fold_journal if source == "journal" else _fold_chat
+    increments, active_users = fold(docs)
+    _apply_increments(increments, _count_new_active_users(active_users, batch_id), batch_id)
+    ROLLUP_DOCUMENTS.inc(len(docs), source=source)
+    return len(docs)
+
+
+def _awaiting_analysis(doc: dict) -> bool:
+    # Nhật ký đồng bộ offline chưa phân tích xong: để dành, gộp khi đã có analysis_source thật
+    if doc.get("analysis_status") not in UNANALYZED_STATUSES:
+        return False
+    return (_now() - doc["_id"].generation_time).total_seconds() < ROLLUP_PENDING_MAX_WAIT_SECONDS
+
+
+def rollup_deferred(token: str, state: dict) -> int:
+    collection = get_journal_collection()
+    projection = SOURCES["journal"]["projection"]
+    record = state.get("inflight_deferred")
+    if record is not None:
+        # Lượt trước dừng sau khi ghi nhận batch: chạy lại đúng các entry đó với cùng batch id
+        docs = list(collection.find({"_id": {"$in": record["ids"]}}, projection))
+    else:
+        deferred = state.get("deferred") or []
+        if not deferred:
+            return 0
+        found = list(collection.find({"_id": {"$in": deferred}}, projection))
+        found_ids = {doc["_id"] for doc in found}
+        docs = [doc for doc in found if not _awaiting_analysis(doc)]
+        # Entry đã bị xóa trong lúc chờ thì chỉ cần bỏ khỏi danh sách
+        deleted = [entry_id for entry_id in deferred if entry_id not in found_ids]
+        if not docs and not deleted:
+            return 0
+        record = {"id": f"journal-deferred:{uuid.uuid4().hex}", "ids": [doc["_id"] for doc in docs], "deleted": deleted}
+        if not _save_progress(token, {"$set": {"inflight_deferred": record}}):
+            return 0
+
+    processed = _apply_batch("journal", record["id"], docs)
+    _save_progress(token, {
+        "$pull": {"deferred": {"$in": record["ids"] + record.get("deleted", [])}},
+        "$unset": {"inflight_deferred": ""},
+    })
+    return processed
+
+
+def rollup_source(token: str, source: str, state: dict) -> int:
+    """Gộp các document mới sau watermark của `source` vào daily_rollups.
+
+    Mỗi batch được ghi nhận vào job (khoảng _id và các entry để dành) trước khi cộng dồn,
+    rồi mới dời watermark; dừng giữa chừng thì lượt sau chạy lại đúng batch đó với cùng id
+    và các ngày đã cộng sẽ bỏ qua.
+    """
+    config = SOURCES[source]
+    collection = config["collection"]()
+    # Không gộp document quá mới: lượt ghi có _id nhỏ hơn vẫn có thể đang tới
+    upper = ObjectId.from_datetime(_now() - timedelta(seconds=ROLLUP_SETTLE_SECONDS))
+    watermark = (state.get("watermarks") or {}).get(source)
+    inflight = (state.get("inflight") or {}).get(source)
+    deferred_room = ROLLUP_MAX_DEFERRED - len(state.get("deferred") or [])
+
+    processed = 0
+    for _ in range(ROLLUP_MAX_BATCHES_PER_RUN):
+        if inflight is not None:
+            id_range = {"$lte": inflight["until"]}
+            if inflight["after"] is not None:
+                id_range["$gt"] = inflight["after"]
+            docs = list(collection.find({"_id": id_range}, config["projection"]).sort("_id", 1))
+            batch = inflight
+            inflight = None
+        else:
+            id_range = {"$lt": upper}
+            if watermark is not None:
+                id_range["$gt"] = watermark
+            docs = list(
+                collection.find({"_id": id_range}, config["projection"])
+                .sort("_id", 1)
+                .limit(ROLLUP_BATCH_SIZE)
+            )
+            if not docs:
+                break
+            deferred = []
+            if source == "journal":
+                deferred = [doc["_id"] for doc in docs if _awaiting_analysis(doc)][:max(0, deferred_room)]
+            batch = {"id": f"{source}:{docs[-1]['_id']}", "after": watermark, "until": docs[-1]["_id"], "deferred": deferred}
+            if not _save_progress(token, {"$set": {f"inflight.{source}": batch}}):
+                break
+
+        skipped = set(batch["deferred"])
+        processed += _apply_batch(source, batch["id"], [doc for doc in docs if doc["_id"] not in skipped])
+        watermark = batch["until"]
+        update = {"$set": {f"watermarks.{source}": watermark}, "$unset": {f"inflight.{source}": ""}}
+        if batch["deferred"]:
+            update["$addToSet"] = {"deferred": {"$each": batch["deferred"]}}
+            deferred_room -= len(batch["deferred"])
+        if not _save_progress(token, update):
+            break
+        if len(docs) < ROLLUP_BATCH_SIZE:
+            break
+
+    if watermark is not None:
+        ROLLUP_LAG_SECONDS.set((_now() - watermark.generation_time).total_seconds(), source=source)
+    return processed
+
+
+def run_rollup_once() -> Optional[Dict[str, int]]:
+    state = _acquire_lease()
+    if state is None:
+        return None
+    token = state["lease_owner"]
+    try:
+        processed = {source: rollup_source(token, source, state) for source in SOURCES}
+        processed["journal"] += rollup_deferred(token, get_job_collection().find_one({"_id": JOB_ID}) or {})
+        return processed
+    finally:
+        _release_lease(token)
+
+
+async def run_rollup_scheduler():
+    while True:
+        try:
+            processed = await asyncio.to_thread(run_rollup_once)
+            if processed and any(processed.values()):
+                print(f"Rollup: đã gộp {processed}")
+        except Exception as e:
+            print(f"Lỗi rollup: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+
+def get_rollup_status() -> dict:
+    state = get_job_collection().find_one({"_id": JOB_ID}) or {}
+    watermarks = state.get("watermarks") or {}
+    return {
+        "last_run_at": state.get("last_run_at"),
+        "running": bool(state.get("lease_owner")),
+        "deferred_entries": len(state.get("deferred") or []),
+        "watermarks": {
+            source: watermarks[source].generation_time if watermarks.get(source) else None
+            for source in SOURCES
+        },
+    }
+
+
+def get_daily_rollups(start_day: str, end_day: str) -> List[dict]:
+    return list(get_rollup_collection().find({"_id": {"$gte": start_day, "$lte": end_day}}).sort("_id", 1))
@@ -0,0 +1,186 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from app.core.config import SYNC_ANALYSIS_CONCURRENCY
+from app.db.database import get_journal_collection
+from app.models.journal import SyncEntry, SyncItemStatus
+from app.services.admission import ai_admission, AdmissionRejected
+from app.services.ai_service import analyze_journal_content, analyze_locally, analysis_source
+from app.services.mood_service import derived_fields, get_user_timezone
+from app.services.job_lease import DUPLICATE_KEY_ERROR
+
+# Số kết quả phân tích gom lại trước khi ghi một bulk_write
+ANALYSIS_WRITE_BATCH = 20
+# Giới hạn số entry pending xử lý trong một lần chạy job nền
+PENDING_SWEEP_LIMIT = 500
+# Entry "analyzing" quá thời gian này (worker chết giữa chừng) được nhận lại như pending
+ANALYSIS_CLAIM_SECONDS = 300
+
+
+def sync_entries(user_id: str, entries: List[SyncEntry]) -> List[SyncItemStatus]:
+    collection = get_journal_collection()
+    tz = get_user_timezone(user_id)
+
+    # client_id trùng ngay trong batch: chỉ ghi lần đầu
+    first_index: Dict[str, int] = {}
+    operations = []
+    op_client_ids: List[str] = []
+    for index, entry in enumerate(entries):
+        if entry.client_id in first_index:
+            continue
+        first_index[entry.client_id] = index
+        op_client_ids.append(entry.client_id)
+        operations.append(UpdateOne(
+            {"user_id": user_id, "client_id": entry.client_id},
+            {"$setOnInsert": {
+                "user_id": user_id,
+                "client_id": entry.client_id,
+                "timestamp": entry.timestamp,
+                "emotion_selected": entry.emotion,
+                "content": entry.content,
+                "image_urls": entry.image_urls,
+                "analysis": None,
+                "analysis_source": "none",
+                "analysis_status": "pending",
+                **derived_fields(entry.timestamp, entry.emotion, tz),
+            }},
+            upsert=True,
+        ))
+
+    # Một round trip cho cả batch; unordered để một lỗi không chặn các entry còn lại
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        upserted = result.upserted_ids
+        failed: Dict[int, int] = {}
+    except BulkWriteError as e:
+        upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+        failed = {err["index"]: err["code"] for err in e.details.get("writeErrors", [])}
+
+    statuses: Dict[str, SyncItemStatus] = {}
+    existing: List[str] = []
+    for op_index, client_id in enumerate(op_client_ids):
+        if op_index in upserted:
+            statuses[client_id] = SyncItemStatus(client_id=client_id, status="created", id=str(upserted[op_index]))
+        elif op_index in failed and failed[op_index] != DUPLICATE_KEY_ERROR:
+            statuses[client_id] = SyncItemStatus(client_id=client_id, status="error")
+        else:
+            # Đã có từ lần sync trước (hoặc request song song vừa ghi)
+            statuses[client_id] = SyncItemStatus(client_id=client_id, status="duplicate")
+            existing.append(client_id)
+
+    if existing:
+        cursor = collection.find(
+            {"user_id": user_id, "client_id": {"$in": existing}},
+            {"_id": 1, "client_id": 1},
+        )
+        for doc in cursor:
+            statuses[doc["client_id"]].id = str(doc["_id"])
+
+    results = []
+    for index, entry in enumerate(entries):
+        status = statuses[entry.client_id]
+        if first_index[entry.client_id] != index:
+            status = SyncItemStatus(client_id=entry.client_id, status="duplicate", id=status.id)
+        results.append(status)
+    return results
+
+
+def _claimable(user_id: str) -> dict:
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=ANALYSIS_CLAIM_SECONDS)
+    return {
+        "user_id": user_id,
+        "$or": [
+            {"analysis_status": "pending"},
+            {"analysis_status": "analyzing", "analysis_claimed_at": {"$lt": stale_before}},
+        ],
+    }
+
+
+def _claim_entry(user_id: str, entry_id, claim: str) -> Optional[dict]:
+    # pending -> analyzing trong một lệnh: hai lần sync chồng nhau không phân tích trùng một entry
+    return get_journal_collection().find_one_and_update(
+        {"_id": entry_id, **_claimable(user_id)},
+        {"$set": {
+            "analysis_status": "analyzing",
+            "analysis_claim": claim,
+            "analysis_claimed_at": datetime.now(timezone.utc),
+        }},
+        projection={"_id": 1, "content": 1, "emotion_selected": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _release_claims(entry_ids: List, claim: str):
+    if entry_ids:
+        get_journal_collection().update_many(
+            {"_id": {"$in": entry_ids}, "analysis_claim": claim},
+            {"$set": {"analysis_status": "pending"}, "$unset": {"analysis_claim": "", "analysis_claimed_at": ""}},
+        )
+
+
+async def _analyze_entry(user_id: str, doc: dict, claim: str):
+    analysis = analyze_locally(doc["content"], doc["emotion_selected"])
+    if analysis is None:
+        # Tính vào token bucket của user như request trực tiếp: sync liên tục không tiêu Gemini vô hạn
+        async with ai_admission.admit(user_id):
+            analysis = await analyze_journal_content(doc["content"], doc["emotion_selected"], [], try_local=False)
+    return UpdateOne(
+        {"_id": doc["_id"], "analysis_claim": claim},
+        {
+            "$set": {
+                "analysis": analysis.model_dump(),
+                "analysis_source": analysis_source(analysis),
+                "analysis_status": "done",
+            },
+            "$unset": {"analysis_claim": "", "analysis_claimed_at": ""},
+        },
+    )
+
+
+async def analyze_pending_entries(user_id: str):
+    # Chạy sau khi đã trả response: phân tích các entry đang chờ, kể cả entry còn sót từ lần trước
+    collection = get_journal_collection()
+    candidates = [doc["_id"] for doc in collection.find(
+        _claimable(user_id), {"_id": 1}
+    ).sort("timestamp", 1).limit(PENDING_SWEEP_LIMIT)]
+    claim = uuid.uuid4().hex
+
+    updates = []
+    for start in range(0, len(candidates), SYNC_ANALYSIS_CONCURRENCY):
+        chunk = [
+            doc for doc in (
+                _claim_entry(user_id, entry_id, claim)
+                for entry_id in candidates[start:start + SYNC_ANALYSIS_CONCURRENCY]
+            )
+            if doc is not None
+        ]
+        results = await asyncio.gather(*(_analyze_entry(user_id, doc, claim) for doc in chunk), return_exceptions=True)
+        shed = False
+        unfinished = []
+        for doc, result in zip(chunk, results):
+            if isinstance(result, AdmissionRejected):
+                shed = True
+                unfinished.append(doc["_id"])
+            elif isinstance(result, Exception):
+                print(f"Lỗi phân tích entry đồng bộ: {result}")
+                unfinished.append(doc["_id"])
+            else:
+                updates.append(result)
+        _release_claims(unfinished, claim)
+
+        if len(updates) >= ANALYSIS_WRITE_BATCH or shed:
+            if updates:
+                collection.bulk_write(updates, ordered=False)
+            updates = []
+        if shed:
+            # Hết token của user hoặc hệ thống quá tải: phần còn lại giữ pending cho lần sync sau
+            print(f"Tạm dừng phân tích entry đồng bộ của {user_id}: vượt giới hạn AI")
+            return
+
+    if updates:
+        collection.bulk_write(updates, ordered=False)
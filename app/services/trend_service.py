@@ -0,0 +1,196 @@
+import math
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.db.database import get_journal_collection
+from app.models.stat import TrendPoint, DistributionBucket, EmotionMatchStat, TrendsResponse
+from app.core.emotions import EMOTION_SCORES, DEFAULT_SCORE
+from app.services.ai_service import analysis_source
+
+# Cửa sổ trung bình trượt dài nhất, cần đọc thêm chừng này ngày trước start_date
+LONGEST_WINDOW_DAYS = 30
+MAX_RANGE_DAYS = 3660
+QUERY_BATCH_SIZE = 2000
+
+PROJECTION = {
+    "_id": 0,
+    "timestamp": 1,
+    "emotion_selected": 1,
+    "mood_score": 1,
+    # Cần cả analysis để nhận ra bản ghi cũ chưa có analysis_source mà là kết quả mặc định
+    "analysis": 1,
+    "analysis_source": 1,
+}
+
+# Kết quả mặc định (sentiment 0, is_match true) và entry chưa phân tích không đưa vào sentiment / match
+UNANALYZED_SOURCES = {"fallback", "none"}
+
+
+def _none_if_nan(value) -> Optional[float]:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(float(value), 3)
+
+
+def load_trend_frame(user_id: str, start_utc: datetime, end_utc: datetime, tz: tzinfo) -> pd.DataFrame:
+    # Chỉ lấy các cột cần tính, dựng thẳng thành mảng thay vì giữ từng dict
+    cursor = get_journal_collection().find(
+        {"user_id": user_id, "timestamp": {"$gte": start_utc, "$lte": end_utc}},
+        PROJECTION,
+    ).batch_size(QUERY_BATCH_SIZE)
+
+    timestamps, emotions, scores, sentiments, matches = [], [], [], [], []
+    for doc in cursor:
+        analysis = doc.get("analysis") or {}
+        if (doc.get("analysis_source") or analysis_source(doc.get("analysis"))) in UNANALYZED_SOURCES:
+            analysis = {}
+        emotion = doc.get("emotion_selected", "Bình thường")
+        timestamps.append(doc["timestamp"])
+        emotions.append(emotion)
+        scores.append(doc.get("mood_score", EMOTION_SCORES.get(emotion, DEFAULT_SCORE)))
+        sentiments.append(analysis.get("sentiment_score", np.nan))
+        is_match = analysis.get("is_match")
+        matches.append(np.nan if is_match is None else float(is_match))
+
+    local_ts = pd.to_datetime(timestamps, utc=True).tz_convert(tz)
+    return pd.DataFrame({
+        "local_ts": local_ts,
+        "emotion": pd.Series(emotions, dtype="object"),
+        "score": np.asarray(scores, dtype=np.float64),
+        "sentiment": np.asarray(sentiments, dtype=np.float64),
+        "match": np.asarray(matches, dtype=np.float64),
+    })
+
+
+def daily_series(frame: pd.DataFrame, first_day: date, end_date: date) -> pd.DataFrame:
+    # Tổng và số lượng theo ngày để trung bình trượt có trọng số theo số nhật ký
+    days = pd.date_range(first_day, end_date, freq="D")
+    local_day = frame["local_ts"].dt.tz_localize(None).dt.normalize()
+    grouped = frame.assign(day=local_day).groupby("day")
+    daily = pd.DataFrame({
+        "entries": grouped.size(),
+        "score_sum": grouped["score"].sum(),
+        "sentiment_sum": grouped["sentiment"].sum(min_count=1),
+        "sentiment_count": grouped["sentiment"].count(),
+    }).reindex(days)
+    return daily.fillna({"entries": 0, "score_sum": 0.0, "sentiment_sum": 0.0, "sentiment_count": 0})
+
+
+def rolling_mean(total: pd.Series, count: pd.Series, window: int) -> np.ndarray:
+    sums = total.rolling(window, min_periods=1).sum().to_numpy()
+    counts = count.rolling(window, min_periods=1).sum().to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def build_points(daily: pd.DataFrame, start_date: date, max_points: int) -> tuple:
+    daily = daily.assign(
+        mood_rolling_7=rolling_mean(daily["score_sum"], daily["entries"], 7),
+        mood_rolling_30=rolling_mean(daily["score_sum"], daily["entries"], 30),
+        sentiment_rolling_7=rolling_mean(daily["sentiment_sum"], daily["sentiment_count"], 7),
+        sentiment_rolling_30=rolling_mean(daily["sentiment_sum"], daily["sentiment_count"], 30),
+    )
+    # Bỏ phần ngày đọc thêm chỉ để làm ấm cửa sổ trượt
+    daily = daily.loc[pd.Timestamp(start_date):]
+
+    # Gộp nhiều ngày thành một điểm khi khoảng thời gian dài
+    bucket_days = max(1, math.ceil(len(daily) / max_points))
+    bucket = np.arange(len(daily)) // bucket_days
+    grouped = daily.groupby(bucket)
+    buckets = pd.DataFrame({
+        "date": daily.index[::bucket_days].date,
+        "entries": grouped["entries"].sum(),
+        "score_sum": grouped["score_sum"].sum(),
+        "sentiment_sum": grouped["sentiment_sum"].sum(),
+        "sentiment_count": grouped["sentiment_count"].sum(),
+        # Giá trị trượt lấy tại ngày cuối của mỗi nhóm
+        "mood_rolling_7": grouped["mood_rolling_7"].last(),
+        "mood_rolling_30": grouped["mood_rolling_30"].last(),
+        "sentiment_rolling_7": grouped["sentiment_rolling_7"].last(),
+        "sentiment_rolling_30": grouped["sentiment_rolling_30"].last(),
+    })
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mood_avg = np.where(buckets["entries"] > 0, buckets["score_sum"] / buckets["entries"], np.nan)
+        sentiment_avg = np.where(
+            buckets["sentiment_count"] > 0, buckets["sentiment_sum"] / buckets["sentiment_count"], np.nan
+        )
+
+    points = [
+        TrendPoint(
+            date=row.date,
+            entries=int(row.entries),
+            mood_avg=_none_if_nan(mood_avg[i]),
+            sentiment_avg=_none_if_nan(sentiment_avg[i]),
+            mood_rolling_7=_none_if_nan(row.mood_rolling_7),
+            mood_rolling_30=_none_if_nan(row.mood_rolling_30),
+            sentiment_rolling_7=_none_if_nan(row.sentiment_rolling_7),
+            sentiment_rolling_30=_none_if_nan(row.sentiment_rolling_30),
+        )
+        for i, row in enumerate(buckets.itertuples(index=False))
+    ]
+    return points, bucket_days
+
+
+def distribution(frame: pd.DataFrame, keys: np.ndarray, size: int) -> List[DistributionBucket]:
+    grouped = frame.groupby(keys)
+    stats = pd.DataFrame({
+        "entries": grouped.size(),
+        "mood_avg": grouped["score"].mean(),
+        "sentiment_avg": grouped["sentiment"].mean(),
+    }).reindex(range(size))
+    return [
+        DistributionBucket(
+            key=key,
+            entries=0 if math.isnan(row.entries) else int(row.entries),
+            mood_avg=_none_if_nan(row.mood_avg),
+            sentiment_avg=_none_if_nan(row.sentiment_avg),
+        )
+        for key, row in zip(range(size), stats.itertuples(index=False))
+    ]
+
+
+def emotion_match(frame: pd.DataFrame) -> List[EmotionMatchStat]:
+    analyzed = frame[frame["match"].notna()]
+    grouped = analyzed.groupby("emotion")["match"].agg(["count", "mean"])
+    grouped = grouped.sort_values("count", ascending=False, kind="stable")
+    return [
+        EmotionMatchStat(emotion=emotion, analyzed=int(row["count"]), match_rate=_none_if_nan(row["mean"]))
+        for emotion, row in grouped.iterrows()
+    ]
+
+
+def compute_trends(
+    user_id: str,
+    start_date: date,
+    end_date: date,
+    tz: tzinfo,
+    max_points: int,
+) -> TrendsResponse:
+    first_day = start_date - timedelta(days=LONGEST_WINDOW_DAYS - 1)
+    start_utc = datetime.combine(first_day, datetime.min.time(), tz).astimezone(timezone.utc).replace(tzinfo=None)
+    end_utc = datetime.combine(end_date, datetime.max.time(), tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+    frame = load_trend_frame(user_id, start_utc, end_utc, tz)
+    points, bucket_days = build_points(daily_series(frame, first_day, end_date), start_date, max_points)
+
+    # Phân bố và tỉ lệ khớp cảm xúc chỉ tính trong khoảng được hỏi
+    in_range = frame[frame["local_ts"].dt.date >= start_date]
+    weekday = distribution(in_range, in_range["local_ts"].dt.weekday.to_numpy(), 7)
+    hourly = distribution(in_range, in_range["local_ts"].dt.hour.to_numpy(), 24)
+    analyzed = int(in_range["match"].notna().sum())
+
+    return TrendsResponse(
+        start_date=start_date,
+        end_date=end_date,
+        bucket_days=bucket_days,
+        total_entries=len(in_range),
+        analyzed_entries=analyzed,
+        match_rate=_none_if_nan(in_range["match"].mean()) if analyzed else None,
+        points=points,
+        weekday=weekday,
+        hourly=hourly,
+        emotion_match=emotion_match(in_range),
+    )
@@ -0,0 +1,131 @@
+"""So sánh bộ phân loại cảm xúc cục bộ với kết quả Gemini đã lưu.
+
+Dữ liệu vào là các nhật ký kèm phân tích Gemini thật, lấy từ MongoDB
+(analysis_source = "ai") hoặc từ file JSONL đã ghi trước đó:
+
+    python -m benchmarks.local_classifier_benchmark --from-mongo --limit 2000 --record gemini.jsonl
+    python -m benchmarks.local_classifier_benchmark --input gemini.jsonl
+
+Mỗi dòng JSONL: {"content": ..., "emotion_selected": ..., "analysis": {...}}
+"""
+import argparse
+import json
+import sys
+import time
+from typing import List
+
+import numpy as np
+
+from app.core.config import LOCAL_CLASSIFIER_MIN_CONFIDENCE
+from app.core.emotions import EMOTION_SCORES, DEFAULT_SCORE
+from app.services.local_classifier import classify
+
+THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+def load_from_mongo(limit: int) -> List[dict]:
+    from app.db.database import get_journal_collection
+
+    cursor = get_journal_collection().find(
+        {
+            "analysis.suggested_emotion": {"$nin": ["", None]},
+            "analysis_source": {"$nin": ["local", "fallback"]},
+            "image_urls.0": {"$exists": False},
+        },
+        {"_id": 0, "content": 1, "emotion_selected": 1, "analysis": 1},
+    ).sort("_id", -1).limit(limit)
+    return list(cursor)
+
+
+def load_from_file(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(samples: List[dict], threshold: float):
+    n = len(samples)
+    latencies = np.empty(n)
+    confidence = np.empty(n)
+    local_score = np.empty(n)
+    gemini_score = np.empty(n)
+    local_level = np.empty(n)
+    gemini_level = np.empty(n)
+    local_match = np.empty(n, dtype=bool)
+    gemini_match = np.empty(n, dtype=bool)
+
+    for i, sample in enumerate(samples):
+        started = time.perf_counter()
+        result = classify(sample.get("content") or "", sample.get("emotion_selected") or "Bình thường")
+        latencies[i] = time.perf_counter() - started
+
+        gemini = sample["analysis"]
+        confidence[i] = result.confidence
+        local_score[i] = result.analysis.sentiment_score
+        gemini_score[i] = float(gemini.get("sentiment_score") or 0.0)
+        local_level[i] = EMOTION_SCORES.get(result.analysis.detected_emotion, DEFAULT_SCORE)
+        gemini_level[i] = EMOTION_SCORES.get(gemini.get("detected_emotion"), DEFAULT_SCORE)
+        local_match[i] = result.analysis.is_match
+        gemini_match[i] = bool(gemini.get("is_match", True))
+
+    latency_ms = latencies * 1000
+    print(f"Số mẫu: {n}")
+    print(
+        "Độ trễ (ms): p50={:.3f} p95={:.3f} p99={:.3f} max={:.3f}".format(
+            *np.percentile(latency_ms, [50, 95, 99]), latency_ms.max()
+        )
+    )
+
+    def report(mask: np.ndarray, label: str):
+        count = int(mask.sum())
+        if count == 0:
+            print(f"{label}: không có mẫu")
+            return
+        exact = np.mean(local_level[mask] == gemini_level[mask])
+        within_one = np.mean(np.abs(local_level[mask] - gemini_level[mask]) <= 1)
+        match_agree = np.mean(local_match[mask] == gemini_match[mask])
+        mae = np.mean(np.abs(local_score[mask] - gemini_score[mask]))
+        corr = np.corrcoef(local_score[mask], gemini_score[mask])[0, 1] if count > 1 else float("nan")
+        print(
+            f"{label}: n={count} ({count / n:.1%}) cảm xúc khớp={exact:.1%} lệch≤1 bậc={within_one:.1%} "
+            f"is_match khớp={match_agree:.1%} MAE điểm={mae:.3f} tương quan={corr:.3f}"
+        )
+
+    report(np.ones(n, dtype=bool), "Tất cả")
+    report(confidence >= threshold, f"Xử lý cục bộ (confidence ≥ {threshold})")
+
+    print("\nNgưỡng | tỉ lệ xử lý cục bộ | cảm xúc khớp | lệch≤1 bậc")
+    for value in THRESHOLDS:
+        mask = confidence >= value
+        if not mask.any():
+            print(f"{value:>6} | {0:>17.1%} |            - |          -")
+            continue
+        exact = np.mean(local_level[mask] == gemini_level[mask])
+        within_one = np.mean(np.abs(local_level[mask] - gemini_level[mask]) <= 1)
+        print(f"{value:>6} | {mask.mean():>17.1%} | {exact:>12.1%} | {within_one:>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="File JSONL kết quả Gemini đã ghi")
+    source.add_argument("--from-mongo", action="store_true", help="Đọc nhật ký đã được Gemini phân tích từ MongoDB")
+    parser.add_argument("--limit", type=int, default=1000, help="Số nhật ký đọc từ MongoDB")
+    parser.add_argument("--record", help="Ghi dữ liệu đọc từ MongoDB ra file JSONL để chạy lại")
+    parser.add_argument("--threshold", type=float, default=LOCAL_CLASSIFIER_MIN_CONFIDENCE)
+    args = parser.parse_args()
+
+    samples = load_from_file(args.input) if args.input else load_from_mongo(args.limit)
+    if not samples:
+        print("Không có dữ liệu để so sánh")
+        sys.exit(1)
+
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for sample in samples:
+                f.write(json.dumps(sample, ensure_ascii=False, default=str) + "\n")
+
+    evaluate(samples, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
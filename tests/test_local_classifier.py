@@ -0,0 +1,42 @@
+import pytest
+
+from app.services.local_classifier import classify
+
+
+@pytest.mark.parametrize("content, selected, detected", [
+    ("Hôm nay hết sức vui", "Tốt", "Tốt"),
+    ("Hôm nay hết sức tuyệt vời", "Rất tốt", "Rất tốt"),
+    ("Hết sức mệt mỏi", "Tệ", "Tệ"),
+])
+def test_het_suc_is_an_intensifier(content, selected, detected):
+    analysis = classify(content, selected).analysis
+    assert analysis.detected_emotion == detected
+    assert analysis.is_match
+
+
+def test_het_suc_strengthens_the_emotion():
+    plain = classify("Hôm nay vui", "Tốt").analysis.sentiment_score
+    assert classify("Hôm nay hết sức vui", "Tốt").analysis.sentiment_score > plain
+    tired = classify("Mệt mỏi", "Tệ").analysis.sentiment_score
+    assert classify("Hết sức mệt mỏi", "Tệ").analysis.sentiment_score < tired
+
+
+@pytest.mark.parametrize("content", ["Hôm nay không vui", "Chẳng hề vui chút nào"])
+def test_negation_flips_positive_words(content):
+    assert classify(content, "Tốt").analysis.sentiment_score < 0
+
+
+def test_het_alone_still_negates():
+    # "hết mệt" = không còn mệt
+    assert classify("Hết mệt rồi", "Tốt").analysis.sentiment_score > 0
+
+
+@pytest.mark.parametrize("intensifier", ["rất", "cực kỳ", "vô cùng"])
+def test_intensifiers_raise_the_score(intensifier):
+    plain = classify("Hôm nay vui", "Tốt").analysis.sentiment_score
+    assert classify(f"Hôm nay {intensifier} vui", "Tốt").analysis.sentiment_score > plain
+
+
+def test_softeners_lower_the_score():
+    plain = classify("Hôm nay buồn", "Tệ").analysis.sentiment_score
+    assert classify("Hôm nay hơi buồn", "Tệ").analysis.sentiment_score > plain
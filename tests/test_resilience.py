@@ -0,0 +1,197 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.core.metrics import AI_HEDGES, AI_RETRIES, CIRCUIT_SHORT_CIRCUITS
+from app.services.fake_model import FakeGenerativeModel
+from app.services.resilience import CircuitBreaker, CircuitOpen, hedged, retry_with_jitter
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 0.05
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(request, clock):
+    # Mỗi test một tên circuit riêng để metric không cộng dồn giữa các test
+    return CircuitBreaker(request.node.name, FAILURE_THRESHOLD, RESET_TIMEOUT, clock=clock)
+
+
+def failing_model() -> FakeGenerativeModel:
+    return FakeGenerativeModel(latency=0, failure_rate=1.0)
+
+
+def healthy_model(latency: float = 0) -> FakeGenerativeModel:
+    return FakeGenerativeModel(latency=latency, failure_rate=0.0)
+
+
+def call(breaker: CircuitBreaker, model: FakeGenerativeModel):
+    return asyncio.run(breaker.call(lambda: model.generate_content_async("xin chào")))
+
+
+def trip(breaker: CircuitBreaker):
+    model = failing_model()
+    for _ in range(FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            call(breaker, model)
+
+
+def test_opens_at_failure_threshold(breaker):
+    model = failing_model()
+    for _ in range(FAILURE_THRESHOLD - 1):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            call(breaker, model)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call(breaker, model)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_success_resets_failure_count(breaker):
+    model = failing_model()
+    for _ in range(FAILURE_THRESHOLD - 1):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            call(breaker, model)
+    call(breaker, healthy_model())
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call(breaker, model)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_short_circuits(breaker):
+    trip(breaker)
+    model = healthy_model()
+    before = CIRCUIT_SHORT_CIRCUITS.value(name=breaker.name)
+
+    with pytest.raises(CircuitOpen):
+        call(breaker, model)
+
+    assert model.calls == 0
+    assert CIRCUIT_SHORT_CIRCUITS.value(name=breaker.name) == before + 1
+
+
+def test_half_open_probe_success_closes(breaker, clock):
+    trip(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    call(breaker, healthy_model())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_failure_reopens(breaker, clock):
+    trip(breaker)
+    clock.now += RESET_TIMEOUT
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call(breaker, failing_model())
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        call(breaker, healthy_model())
+
+
+def test_half_open_allows_one_probe_at_a_time(breaker, clock):
+    trip(breaker)
+    clock.now += RESET_TIMEOUT
+
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_gives_back_half_open_slot(breaker, clock):
+    trip(breaker)
+    clock.now += RESET_TIMEOUT
+    slow = healthy_model(latency=10)
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(breaker.call(lambda: slow.generate_content_async("xin chào")))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_non_transient_error_does_not_trip(breaker):
+    async def blocked():
+        raise google_exceptions.InvalidArgument("prompt bị chặn")
+
+    for _ in range(FAILURE_THRESHOLD):
+        with pytest.raises(google_exceptions.InvalidArgument):
+            asyncio.run(breaker.call(blocked))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_transient_errors_until_attempts_run_out():
+    model = failing_model()
+    before = AI_RETRIES.value(function="test_transient")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        asyncio.run(retry_with_jitter(lambda: model.generate_content_async("x"), "test_transient", 3, 0, 0))
+
+    assert model.calls == 3
+    assert AI_RETRIES.value(function="test_transient") == before + 2
+
+
+def test_does_not_retry_non_transient_errors():
+    calls = []
+
+    async def blocked():
+        calls.append(1)
+        raise google_exceptions.InvalidArgument("prompt bị chặn")
+
+    with pytest.raises(google_exceptions.InvalidArgument):
+        asyncio.run(retry_with_jitter(blocked, "test_non_transient", 3, 0, 0))
+    assert len(calls) == 1
+
+
+def test_hedge_not_sent_when_primary_is_fast():
+    model = healthy_model()
+    asyncio.run(hedged(lambda: model.generate_content_async("x"), "test_hedge_fast", delay=1.0))
+    assert model.calls == 1
+
+
+def test_hedge_returns_faster_backup_and_cancels_primary():
+    models = iter([healthy_model(latency=10), healthy_model(latency=0)])
+    cancelled = []
+
+    async def make_call():
+        model = next(models)
+        try:
+            return await model.generate_content_async("x")
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    before = AI_HEDGES.value(function="test_hedge", winner="backup")
+    response = asyncio.run(hedged(make_call, "test_hedge", delay=0.01))
+
+    assert response.text
+    assert AI_HEDGES.value(function="test_hedge", winner="backup") == before + 1
+    assert len(cancelled) == 1 and cancelled[0].latency == 10
+
+
+def test_hedge_falls_back_to_primary_when_backup_fails():
+    models = iter([healthy_model(latency=0.05), failing_model()])
+    before = AI_HEDGES.value(function="test_hedge_backup_fails", winner="primary")
+
+    asyncio.run(hedged(lambda: next(models).generate_content_async("x"), "test_hedge_backup_fails", delay=0.01))
+
+    assert AI_HEDGES.value(function="test_hedge_backup_fails", winner="primary") == before + 1
@@ -0,0 +1,189 @@
+"""Chạy từng endpoint có trong ROUND_TRIP_BUDGETS với MONGO_ROUND_TRIP_ASSERT bật.
+
+Cần MongoDB thật (mongomock không phát command event của pymongo):
+
+    MONGO_TEST_URI=mongodb://localhost:27017 python -m pytest tests/test_round_trip_budgets.py
+
+Test dùng database riêng (DB_NAME_TEST, mặc định moodpress_round_trip_test) và xóa nó khi xong.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+TEST_DB_NAME = os.getenv("DB_NAME_TEST", "moodpress_round_trip_test")
+
+if MONGO_TEST_URI:
+    # Phải đặt trước khi import app: config và kết nối database đọc biến môi trường lúc import
+    os.environ.update(
+        MONGO_URI=MONGO_TEST_URI,
+        DB_NAME=TEST_DB_NAME,
+        MONGO_ROUND_TRIP_ASSERT="true",
+        AI_FAKE_MODEL="true",
+        AI_FAKE_LATENCY_SECONDS="0",
+        BACKFILL_ENABLED="false",
+        ROLLUP_ENABLED="false",
+        CHAT_COMPACTION_ENABLED="false",
+    )
+
+# Nhiều hơn batch đầu mặc định (101) để lộ getMore trong các truy vấn quét toàn bộ nhật ký
+HISTORY_DAYS = 150
+
+
+@pytest.fixture(scope="module")
+def client():
+    if not MONGO_TEST_URI:
+        pytest.skip("Cần MONGO_TEST_URI trỏ tới MongoDB thật")
+    from fastapi.testclient import TestClient
+    from app.db import database
+    from app.main import app
+
+    database.client.drop_database(TEST_DB_NAME)
+    with TestClient(app) as test_client:
+        yield test_client
+    database.client.drop_database(TEST_DB_NAME)
+
+
+@pytest.fixture
+def headers(client):
+    # Mỗi test một user mới: không chạm giới hạn AI theo user và không lẫn dữ liệu
+    return {"X-User-ID": f"round-trip-{uuid.uuid4().hex}"}
+
+
+@pytest.fixture
+def seeded_headers(headers):
+    from app.db.database import get_journal_collection
+    from app.services.mood_service import derived_fields, resolve_timezone
+
+    tz = resolve_timezone(None)
+    now = datetime.utcnow()
+    entries = []
+    for day in range(HISTORY_DAYS):
+        timestamp = now - timedelta(days=day)
+        entries.append({
+            "user_id": headers["X-User-ID"],
+            "content": f"Nhật ký ngày {day}",
+            "emotion_selected": "Tốt",
+            "timestamp": timestamp,
+            "image_urls": [],
+            "analysis": None,
+            **derived_fields(timestamp, "Tốt", tz),
+        })
+    get_journal_collection().insert_many(entries)
+    return headers
+
+
+@pytest.fixture
+def entry_id(client, headers):
+    response = client.post(
+        "/journal/new",
+        data={"content": "Hôm nay mình rất vui", "emotion": "Tốt", "timestamp": datetime.utcnow().isoformat()},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    return response.json()["_id"]
+
+
+@pytest.fixture(params=[False, True], ids=["legacy", "precomputed"])
+def stats_path(request):
+    from app.services import backfill_service
+
+    backfill_service._complete = request.param
+    backfill_service._complete_checked_at = datetime.now(timezone.utc)
+    yield request.param
+    backfill_service._complete = False
+    backfill_service._complete_checked_at = None
+
+
+# Endpoint nào trong ROUND_TRIP_BUDGETS cũng phải có ít nhất một test bên dưới
+COVERED_ENDPOINTS = set()
+
+
+def covers(*endpoints):
+    COVERED_ENDPOINTS.update(endpoints)
+    return lambda test: test
+
+
+@covers("POST /journal/new")
+def test_create_entry(client, headers):
+    for key in (None, uuid.uuid4().hex):
+        request_headers = dict(headers, **({"Idempotency-Key": key} if key else {}))
+        response = client.post(
+            "/journal/new",
+            data={"content": "Đi chợ mua rau", "emotion": "Tốt", "timestamp": datetime.utcnow().isoformat()},
+            headers=request_headers,
+        )
+        assert response.status_code == 200
+
+
+@covers("POST /journal/sync")
+def test_sync_entries(client, headers):
+    entries = [
+        {"client_id": uuid.uuid4().hex, "content": "Offline", "emotion": "Tệ", "timestamp": datetime.utcnow().isoformat()}
+        for _ in range(20)
+    ]
+    response = client.post("/journal/sync", json={"entries": entries}, headers=headers)
+    assert response.status_code == 200
+
+
+@covers("GET /journal/history", "GET /journal/first-date")
+def test_read_history(client, seeded_headers):
+    today = datetime.utcnow()
+    assert client.get(f"/journal/history?year={today.year}&month={today.month}", headers=seeded_headers).status_code == 200
+    assert client.get("/journal/first-date", headers=seeded_headers).status_code == 200
+
+
+@covers("GET /journal/{entry_id}", "PUT /journal/{entry_id}", "DELETE /journal/{entry_id}")
+def test_single_entry(client, headers, entry_id):
+    assert client.get(f"/journal/{entry_id}", headers=headers).status_code == 200
+    assert client.put(f"/journal/{entry_id}", data={"emotion": "Rất tốt"}, headers=headers).status_code == 200
+    assert client.delete(f"/journal/{entry_id}", headers=headers).status_code == 204
+
+
+@covers("POST /journal/analyze")
+def test_analyze_only(client, headers):
+    response = client.post("/journal/analyze", json={"content": "Hơi mệt", "emotion": "Tệ"}, headers=headers)
+    assert response.status_code == 200
+
+
+@covers("POST /chat/send", "GET /chat/history", "DELETE /chat/history")
+def test_chat(client, headers):
+    # User mới, chưa có tin nhắn: trường hợp phải đọc thêm chat_buckets
+    for key in (uuid.uuid4().hex, None):
+        request_headers = dict(headers, **({"Idempotency-Key": key} if key else {}))
+        assert client.post("/chat/send", json={"message": "chào"}, headers=request_headers).status_code == 200
+    assert client.get("/chat/history?limit=30", headers=headers).status_code == 200
+    assert client.delete("/chat/history", headers=headers).status_code == 200
+
+
+@covers("GET /user/profile", "PUT /user/profile")
+def test_profile(client, headers):
+    assert client.get("/user/profile", headers=headers).status_code == 200
+    assert client.put("/user/profile", json={"name": "Lan", "gender": "nữ"}, headers=headers).status_code == 200
+
+
+@covers("GET /stats/weekly", "GET /stats/monthly")
+def test_stats(client, seeded_headers, stats_path):
+    today = datetime.utcnow().date()
+    week_start = today - timedelta(days=today.weekday())
+    for offset in ("", "&timezone_offset=420"):
+        response = client.get(f"/stats/weekly?start_date={week_start}{offset}", headers=seeded_headers)
+        assert response.status_code == 200
+        response = client.get(
+            f"/stats/monthly?start_date={today - timedelta(days=30)}&end_date={today}{offset}",
+            headers=seeded_headers,
+        )
+        assert response.status_code == 200
+
+
+@covers("GET /relax/sounds")
+def test_relax_sounds(client, headers):
+    assert client.get("/relax/sounds", headers=headers).status_code == 200
+
+
+def test_every_budget_is_exercised():
+    from app.db.monitoring import ROUND_TRIP_BUDGETS
+
+    assert set(ROUND_TRIP_BUDGETS) <= COVERED_ENDPOINTS